@@ -1,10 +1,21 @@
 import argparse
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 import logging
-import re
+import os
 import subprocess
+from typing import Iterable
 
 from ..benchmarks import Benchmarks
 from .. import options
+from .. import limits
+from ..BenchmaxException import BenchmaxException
+from . import process
+from .cgroup import JobCGroup
+from ..manifest import save_manifests
+from ..results.Cache import Cache
+from ..results.Journal import Journal
 from ..results.Results import Results
 from ..results.Result import Result
 from ..results.XMLWriter import XMLWriter
@@ -25,7 +36,32 @@ def add_backend_options(parser: argparse.ArgumentParser):
     )
 
     # Local Backend Settings
-    # Nothing here so far
+    backend_group.add_argument(
+        "--local.jobs",
+        help="number of benchmarks to run in parallel with the local backend "
+        + "(0 uses all available cores)",
+        dest="local_jobs",
+        metavar="N",
+        type=options.positive_int,
+        default=1,
+    )
+
+    backend_group.add_argument(
+        "--local.cgroup",
+        help="run each local job in its own cgroup v2 which limits and "
+        + "measures the memory of all its processes (requires delegation)",
+        dest="local_cgroup",
+        action="store_true",
+    )
+
+    backend_group.add_argument(
+        "--local.executor",
+        help="how the local backend starts the tools: through a shell, or "
+        + "directly from an asyncio event loop",
+        dest="local_executor",
+        choices=["shell", "asyncio"],
+        default="shell",
+    )
 
     # Slurm Backend Settings
     backend_group.add_argument(
@@ -42,6 +78,41 @@ def add_backend_options(parser: argparse.ArgumentParser):
         action="store_true",
     )
 
+    backend_group.add_argument(
+        "--slurm.keep-output",
+        help="write the raw output of the tools to the log files, the results "
+        + "are parsed on the compute nodes either way",
+        dest="slurm_keep_output",
+        action="store_true",
+    )
+
+    backend_group.add_argument(
+        "--slurm.stage-logs",
+        help="write the logs and records of each array task to the node-local "
+        + "$TMPDIR and copy them to the temporary directory as one compressed "
+        + "bundle when the task ends",
+        dest="slurm_stage_logs",
+        action="store_true",
+    )
+
+    backend_group.add_argument(
+        "--slurm.work-queue",
+        help="let the array tasks take the benchmarks from a shared queue "
+        + "until it is empty, instead of running fixed slices",
+        dest="slurm_work_queue",
+        action="store_true",
+    )
+
+    backend_group.add_argument(
+        "--slurm.retries",
+        help="number of times the benchmarks without result, e.g. due to failed "
+        + "nodes or array tasks which exceeded their time limit, are submitted again",
+        dest="slurm_retries",
+        metavar="N",
+        type=options.positive_int,
+        default=2,
+    )
+
     backend_group.add_argument(
         "--slurm.archive-logs",
         help="store logs in tgz archive with given prefix",
@@ -58,6 +129,40 @@ def add_backend_options(parser: argparse.ArgumentParser):
         type=options.positive_int,
     )
 
+    backend_group.add_argument(
+        "--slurm.cpus-per-task",
+        help="number of cpus requested per array task, each of which runs "
+        + "one benchmark at a time (the memory limit is requested per cpu)",
+        dest="slurm_cpus_per_task",
+        metavar="K",
+        type=options.positive_int,
+        default=1,
+    )
+
+    backend_group.add_argument(
+        "--slurm.slice-size",
+        help="number of benchmarks per array task; if more tasks than the array "
+        + "size are needed, the benchmarks are split into several array jobs",
+        dest="slurm_slice_size",
+        metavar="N",
+        type=options.positive_int,
+    )
+
+    backend_group.add_argument(
+        "--slurm.throttle",
+        help="maximum number of simultaneously running tasks of each array job",
+        dest="slurm_throttle",
+        metavar="K",
+        type=options.positive_int,
+    )
+
+    backend_group.add_argument(
+        "--slurm.chain",
+        help="start each array job only after the previous one has finished",
+        dest="slurm_chain",
+        action="store_true",
+    )
+
     backend_group.add_argument(
         "--slurm.sbatch-options",
         help="additional slurm sbatch options as a string in quotes (note the =)",
@@ -85,8 +190,159 @@ def add_backend_options(parser: argparse.ArgumentParser):
     # TODO
 
 
+def journal_filename() -> str:
+    if options.args().journal_file is not None:
+        return options.args().journal_file
+    if options.args().csv_file is not None:
+        return options.args().csv_file + ".journal"
+    return options.args().xml_file + ".journal"
+
+
+def open_journal(benchmarks: Benchmarks, results: Results) -> Journal:
+    """
+    Opens the journal for the results of this run.
+    If the run is resumed, the results of the journal are loaded.
+    """
+    journal = Journal(journal_filename())
+    if options.args().resume:
+        if journal.exists():
+            count = journal.load(benchmarks, results)
+            logging.info(f"loaded {count} results from journal {journal.filename}")
+        else:
+            logging.warning(f"no journal {journal.filename} found to resume from")
+    elif journal.exists():
+        raise BenchmaxException(
+            f"found journal {journal.filename} of an unfinished run. "
+            + "Use --resume to continue the run, or delete the journal."
+        )
+    journal.open(append=options.args().resume)
+    return journal
+
+
+class ResultCollector:
+    """
+    Receives the results from the backends and records them in the results,
+    the journal and, if enabled, the result cache.
+    Results which are already known from the journal are loaded on
+    construction, results from the cache when the pending pairs are requested,
+    so that only the remaining pairs have to be executed.
+    """
+
+    def __init__(self, benchmarks: Benchmarks):
+        self.benchmarks = benchmarks
+        self.results = Results()
+        self.journal = open_journal(benchmarks, self.results)
+        self.resumed = self.results.size()
+        self.executed = 0
+        self.tier = 0
+        self.cache = None
+        if options.args().cache_dir is not None:
+            self.cache = Cache(options.args().cache_dir, options.args().cache_size)
+
+    def escalating(self) -> bool:
+        return len(options.args().timeout_tiers) > 1
+
+    def tiers(self):
+        """
+        Iterates over the timeout tiers, setting the timeout of each tier.
+        Without escalation, there is a single tier with the given timeout.
+        """
+        for tier, timeout in enumerate(options.args().timeout_tiers):
+            if self.escalating():
+                logging.info(f"timeout tier {tier}: {timeout}s")
+            self.tier = tier
+            options.args().timeout = timeout
+            yield tier
+
+    def needs_run(self, result: Result | None, escalated: bool = True) -> bool:
+        if result is None:
+            return True
+        # only timeouts of previous tiers are run again, unless the pair has
+        # its own timeout, which is the same in all tiers
+        if result.answer != "timeout" or not self.escalating() or not escalated:
+            return False
+        return int(result.additional_info.get("timeout_tier", self.tier)) < self.tier
+
+    def missing(self, pair_ids: Iterable[int]) -> array:
+        """Returns the ids of the given pairs without result in the current tier."""
+
+        def needs_run(pair_id: int) -> bool:
+            tool, file = self.benchmarks.pair(pair_id)
+            escalated = limits.timeout_rule(tool, file) is None
+            return self.needs_run(self.results.get(tool, file), escalated)
+
+        return array("I", filter(needs_run, pair_ids))
+
+    def pending(self) -> array:
+        """Returns the ids of the pairs to execute in the current tier, in order."""
+        pair_ids = self.missing(self.benchmarks.scheduled())
+        if self.cache is not None and len(pair_ids) > 0:
+            pair_ids = self.lookup_cache(pair_ids)
+        return pair_ids
+
+    def lookup_cache(self, pair_ids: array) -> array:
+        # hashing the inputs is I/O bound and can be done concurrently
+        with ThreadPoolExecutor() as pool:
+            files = {
+                self.benchmarks.files[self.benchmarks.file_ids[i]] for i in pair_ids
+            }
+            list(pool.map(self.cache.digest, files))
+        # the hashes of the input files are recorded for the next run
+        save_manifests()
+        hits = self.cache.hits
+        remaining = array("I")
+        for i in pair_ids:
+            tool, file = self.benchmarks.pair(i)
+            result = self.cache.get(tool, file)
+            if result is None:
+                remaining.append(i)
+            else:
+                self.mark_tier(result)
+                self.results.add_result(tool, file, result)
+                self.journal.append(tool, file, result)
+        logging.info(f"{self.cache.hits - hits} results found in the cache")
+        return remaining
+
+    def mark_tier(self, result: Result):
+        if self.escalating():
+            result.additional_info["timeout_tier"] = str(self.tier)
+
+    def add(self, tool: Tool, file: str, result: Result, journal: bool = True):
+        """
+        Records a result. Results which are persisted by the backend anyway,
+        like the records of slurm jobs, need not be journaled.
+        """
+        self.mark_tier(result)
+        self.results.add_result(tool, file, result)
+        if journal:
+            self.journal.append(tool, file, result)
+        if self.cache is not None:
+            self.cache.store(tool, file, result)
+        self.executed += 1
+
+    def finish(self):
+        self.journal.close()
+        check_for_missing_results(self.benchmarks, self.results)
+        write_results(self.benchmarks, self.results)
+        self.journal.remove()
+        if self.cache is not None:
+            self.cache.evict()
+        summary = f"{self.executed} benchmarks executed"
+        if self.resumed > 0:
+            summary += f", {self.resumed} results from the journal"
+        if self.cache is not None:
+            summary += f", {self.cache.hits} results from the cache"
+        logging.info(summary)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, exc_value, traceback):
+        self.journal.close()
+
+
 def check_for_missing_results(benchmarks: Benchmarks, results: Results):
-    for tool, file in benchmarks.pairs:
+    for tool, file in benchmarks.pairs():
         res = results.get(tool, file)
         if not res and tool.can_handle(file):
             logging.warning(f"Missing result for {tool} on {file}")
@@ -103,7 +359,7 @@ def sanitize_result(tool: Tool, file: str, result: Result):
         result.stderr = ""
         result.stdout = ""
         if timediff > 2 * options.args().gracetime:
-            # 2* because slurm already adds gracetime to the timeout...
+            # the tools are killed one grace time after the timeout at the latest
             logging.warning(f"Running {tool} on {file} exceeded grace time")
             logging.warning(
                 "runtime: "
@@ -114,6 +370,16 @@ def sanitize_result(tool: Tool, file: str, result: Result):
     # TODO: do more, also for memout?
 
 
+def finalize_result(tool: Tool, file: str, result: Result, oom_killed=False):
+    tool.parse_additional(result)
+    if oom_killed and result.answer not in ["sat", "unsat", "unknown"]:
+        result.answer = "memout"
+    sanitize_result(tool, file, result)
+    # the output is not needed anymore once it is parsed
+    result.stdout = ""
+    result.stderr = ""
+
+
 def write_results(benchmarks: Benchmarks, results: Results):
     logging.info("Writing results")
 
@@ -137,10 +403,56 @@ def call_program(cmd: str):
     return res
 
 
-def parse_peak_memory(output: str) -> int:
-    m = re.search(r"Maximum resident set size \(kbytes\): ([0-9]+)", output)
-    if m:
-        return int(m.group(1))
-    else:
-        logging.warning("Could not extract memory usage from output: " + output)
-        return -1  # TODO: avoid magic number
+def output_limit() -> int:
+    return options.args().output_limit * 1000
+
+
+def tool_limits(job_cgroup: JobCGroup | None) -> tuple:
+    """
+    The limits of the run as arguments for process.run after the command line.
+    """
+    return (
+        options.args().timeout,
+        options.args().gracetime,
+        output_limit(),
+        options.args().memout,
+        None if job_cgroup is None else job_cgroup.path,
+    )
+
+
+def tool_result(
+    tool: Tool,
+    file: str,
+    completed: process.Completed,
+    job_cgroup: JobCGroup | None = None,
+) -> Result:
+    """
+    Returns the finalized result of the completed tool. If a cgroup is given,
+    the job ran in it and is measured by it.
+    """
+    result = Result()
+    result.runtime = timedelta(seconds=completed.runtime)
+    result.exit_code = completed.exit_code
+    result.stdout = completed.stdout.decode(errors="replace")
+    result.stderr = completed.stderr.decode(errors="replace")
+    result.user_time = timedelta(seconds=completed.user_time)
+    result.system_time = timedelta(seconds=completed.system_time)
+    result.peak_memory_kbytes = completed.peak_memory_kbytes
+    oom_killed = False
+    if job_cgroup is not None:
+        oom_killed = job_cgroup.set_resource_usage(result)
+    finalize_result(tool, file, result, oom_killed)
+    return result
+
+
+def run_tool(
+    tool: Tool, file: str, argv: list[str], job_cgroup: JobCGroup | None = None
+) -> tuple[Result, process.Completed]:
+    """
+    Runs the command of the tool on the file with the limits of the run and
+    returns its finalized result, and the completed process with the output.
+    If a cgroup is given, the job runs in it and is measured by it.
+    Raises OSError if the tool cannot be started.
+    """
+    completed = process.run(argv, *tool_limits(job_cgroup))
+    return tool_result(tool, file, completed, job_cgroup), completed
@@ -0,0 +1,38 @@
+def omission_marker(omitted: int) -> bytes:
+    return f"\n[... {omitted} bytes omitted by benchmax ...]\n".encode()
+
+
+class BoundedCapture:
+    """
+    Collects the output of a tool while retaining at most limit bytes:
+    the first half of the limit from the beginning of the output and the
+    second half from its end, where e.g. statistics are usually printed.
+    """
+
+    def __init__(self, limit: int):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if len(self.head) < self.head_limit:
+            n = self.head_limit - len(self.head)
+            self.head += data[:n]
+            data = data[n:]
+        self.tail += data
+        # trimming only when twice the limit is reached keeps writes amortized O(1)
+        if len(self.tail) > 2 * self.tail_limit:
+            del self.tail[: len(self.tail) - self.tail_limit]
+
+    def getvalue(self) -> bytes:
+        tail = self.tail[max(0, len(self.tail) - self.tail_limit) :]
+        omitted = self.size - len(self.head) - len(tail)
+        if omitted == 0:
+            return bytes(self.head + tail)
+        return bytes(self.head) + omission_marker(omitted) + bytes(tail)
+
+    def text(self) -> str:
+        return self.getvalue().decode(errors="replace")
@@ -0,0 +1,190 @@
+from datetime import timedelta
+import itertools
+import logging
+import os
+import time
+
+from .. import options
+from ..results.Result import Result
+from . import process
+
+CONTROLLERS = ["memory", "cpu"]
+
+# seconds to wait for the processes of a killed cgroup to exit before it is
+# removed
+REMOVE_TIMEOUT_S = 5
+
+__BASE: str | None = None
+# the controllers which were enabled for the subtree by setup()
+__ENABLED: list[str] = []
+__COUNTER = itertools.count()
+
+
+def read_file(path: str) -> str:
+    with open(path, "r") as f:
+        return f.read()
+
+
+def write_file(path: str, content: str):
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def read_keyed(path: str) -> dict[str, int]:
+    # format of cpu.stat and memory.events: one "<key> <value>" per line
+    result = {}
+    for line in read_file(path).splitlines():
+        key, value = line.split()
+        result[key] = int(value)
+    return result
+
+
+def cgroup2_mount() -> str | None:
+    # usually /sys/fs/cgroup, or /sys/fs/cgroup/unified on hybrid systems
+    for line in read_file("/proc/self/mounts").splitlines():
+        fields = line.split()
+        if len(fields) > 2 and fields[2] == "cgroup2":
+            return fields[1]
+    return None
+
+
+def own_cgroup() -> str | None:
+    mount = cgroup2_mount()
+    if mount is None:
+        return None
+    for line in read_file("/proc/self/cgroup").splitlines():
+        # the unified hierarchy has the form 0::<path>
+        if line.startswith("0::"):
+            return os.path.normpath(mount + "/" + line[3:])
+    return None
+
+
+def setup() -> bool:
+    """
+    Prepares the cgroup of benchmax for running each job in its own leaf.
+    This requires a delegated cgroup v2 subtree which contains only benchmax,
+    as e.g. created by `systemd-run --user --scope -p Delegate=yes benchmax ...`.
+    The benchmax process itself is moved to a separate leaf, as cgroups with
+    enabled controllers may not contain processes.
+    """
+    global __BASE, __ENABLED
+    try:
+        base = own_cgroup()
+        if base is None:
+            raise OSError("no cgroup v2 hierarchy found")
+        available = read_file(base + "/cgroup.controllers").split()
+        missing = [c for c in CONTROLLERS if c not in available]
+        if len(missing) > 0:
+            raise OSError(f"controllers {missing} are not delegated to {base}")
+        enabled = read_file(base + "/cgroup.subtree_control").split()
+        supervisor = base + f"/benchmax-{os.getpid()}"
+        os.makedirs(supervisor, exist_ok=True)
+        write_file(supervisor + "/cgroup.procs", str(os.getpid()))
+        try:
+            write_file(
+                base + "/cgroup.subtree_control",
+                " ".join("+" + c for c in CONTROLLERS),
+            )
+        except OSError:
+            # e.g. other processes are still in the base cgroup
+            write_file(base + "/cgroup.procs", str(os.getpid()))
+            os.rmdir(supervisor)
+            raise
+    except OSError as e:
+        logging.warning(f"cgroup isolation is not available, using rlimits: {e}")
+        return False
+    logging.info(f"running jobs in cgroups below {base}")
+    __BASE = base
+    __ENABLED = [c for c in CONTROLLERS if c not in enabled]
+    return True
+
+
+def teardown():
+    """
+    Undoes setup() once all jobs are finished: the controllers are disabled
+    again, and benchmax is moved back to its cgroup and its leaf removed.
+    """
+    global __BASE
+    if __BASE is None:
+        return
+    base, __BASE = __BASE, None
+    supervisor = base + f"/benchmax-{os.getpid()}"
+    try:
+        # processes may only be moved back once the controllers are disabled
+        if len(__ENABLED) > 0:
+            write_file(
+                base + "/cgroup.subtree_control",
+                " ".join("-" + c for c in __ENABLED),
+            )
+        write_file(base + "/cgroup.procs", str(os.getpid()))
+        os.rmdir(supervisor)
+    except OSError as e:
+        logging.warning(f"could not restore cgroup {base}: {e}")
+
+
+def enabled() -> bool:
+    return __BASE is not None
+
+
+def new_job_path() -> str:
+    return f"{__BASE}/job-{os.getpid()}-{next(__COUNTER)}"
+
+
+class JobCGroup:
+    """A leaf cgroup limiting and measuring a single job."""
+
+    def __init__(self):
+        self.path = new_job_path()
+        os.mkdir(self.path)
+        write_file(self.path + "/memory.max", str(options.args().memout * 1024))
+        if os.path.exists(self.path + "/memory.swap.max"):
+            write_file(self.path + "/memory.swap.max", "0")
+
+    def kill(self):
+        process.kill_cgroup(self.path)
+
+    def peak_memory_kbytes(self) -> int | None:
+        # memory.peak is only available since Linux 5.19
+        try:
+            return int(read_file(self.path + "/memory.peak")) // 1024
+        except OSError:
+            return None
+
+    def cpu_times(self) -> tuple[timedelta, timedelta]:
+        stat = read_keyed(self.path + "/cpu.stat")
+        return (
+            timedelta(microseconds=stat["user_usec"]),
+            timedelta(microseconds=stat["system_usec"]),
+        )
+
+    def oom_killed(self) -> bool:
+        return read_keyed(self.path + "/memory.events").get("oom_kill", 0) > 0
+
+    def set_resource_usage(self, result: Result) -> bool:
+        """
+        Replaces the rusage measurements by the accounting of the cgroup,
+        which covers all processes of the job.
+        Returns whether a process of the job was killed for exceeding memory.
+        """
+        peak = self.peak_memory_kbytes()
+        if peak is not None:
+            result.peak_memory_kbytes = peak
+        result.user_time, result.system_time = self.cpu_times()
+        return self.oom_killed()
+
+    def populated(self) -> bool:
+        return read_keyed(self.path + "/cgroup.events").get("populated", 0) == 1
+
+    def remove(self):
+        # descendants which daemonized would keep the cgroup populated
+        if self.populated():
+            self.kill()
+            # the processes are killed asynchronously, and the cgroup cannot
+            # be removed before all of them have exited
+            deadline = time.monotonic() + REMOVE_TIMEOUT_S
+            while self.populated() and time.monotonic() < deadline:
+                time.sleep(0.01)
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            logging.warning(f"could not remove cgroup {self.path}: {e}")
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import shlex
+from typing import Callable, Sequence
+
+from ..benchmarks import Benchmarks
+from ..results.Result import Result
+from ..tools.Tool import Tool
+from . import cgroup, process
+from .backends import finalize_result, tool_limits, tool_result
+from .cgroup import JobCGroup
+
+
+async def execute(tool: Tool, file: str) -> Result:
+    # the tool is started directly, without a shell
+    argv = shlex.split(tool.get_command_line(file))
+    job_cgroup = JobCGroup() if cgroup.enabled() else None
+    try:
+        completed = await process.run_async(argv, *tool_limits(job_cgroup))
+        result = tool_result(tool, file, completed, job_cgroup)
+    except OSError as e:
+        # like a shell which cannot find the tool, so one job does not abort
+        # the whole run
+        logging.warning(f"failed to run {argv[0]} on {file}: {e}")
+        result = Result()
+        result.exit_code = 127
+        result.stderr = str(e)
+        finalize_result(tool, file, result)
+    finally:
+        if job_cgroup is not None:
+            job_cgroup.remove()
+    return result
+
+
+async def execute_all(
+    benchmarks: Benchmarks,
+    pair_ids: Sequence[int],
+    jobs: int,
+    callback: Callable[[int, Result], None],
+):
+    ids = iter(pair_ids)
+
+    async def worker():
+        # all workers draw from the same iterator, so each pair runs once
+        for pair_id in ids:
+            tool, file = benchmarks.pair(pair_id)
+            callback(pair_id, await execute(tool, file))
+
+    # on cancellation (e.g. ctrl-c), each job kills the process group of its
+    # tool before it is finished
+    await asyncio.gather(*[worker() for _ in range(min(jobs, len(pair_ids)))])
+
+
+def run_all(
+    benchmarks: Benchmarks,
+    pair_ids: Sequence[int],
+    jobs: int,
+    callback: Callable[[int, Result], None],
+):
+    """
+    Executes the given pairs from a single event loop, running at most jobs
+    tools at the same time without a thread per tool: the pipes of the tools
+    and the reports of the helper which spawns them are read by the loop, and
+    the timeouts are timers of the loop. The callback is invoked in the event
+    loop with the id of the pair and its result as soon as a pair is finished.
+    """
+    asyncio.run(execute_all(benchmarks, pair_ids, jobs, callback))
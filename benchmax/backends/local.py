@@ -1,50 +1,93 @@
-from datetime import timedelta
+import multiprocessing
+import os
 from tqdm import tqdm
-from timeit import default_timer
+from typing import Sequence
 
 from .backends import *
+from . import cgroup, executor
+from .cgroup import JobCGroup
 from ..benchmarks import Benchmarks
-from .. import options
+from .. import limits, options
 from ..results.Result import Result
-from ..results.Results import Results
 from ..tools.Tool import Tool
 
 
-def process(tool: Tool, file: str, results: Results):
-    # prepare command
-    call: str = ""
-    call += "ulimit -S -t " + str(options.args().timeout) + " && "
-    call += "ulimit -S -v " + str(options.args().memout) + " && "
-    call += "/usr/bin/time -v "
-    call += tool.get_command_line(file)
+def process(tool: Tool, file: str) -> Result:
+    job_cgroup = JobCGroup() if cgroup.enabled() else None
+    # the shell interprets the command line, the limits are set by benchmax
+    argv = ["/bin/sh", "-c", "exec " + tool.get_command_line(file)]
+    try:
+        result, _ = run_tool(tool, file, argv, job_cgroup)
+    finally:
+        if job_cgroup is not None:
+            job_cgroup.remove()
+    return result
 
-    # call and time command
-    start = default_timer()
-    out = call_program(call)
-    end = default_timer()
 
-    # extract result information
-    result = Result()
-    result.runtime = timedelta(seconds=(end - start))
-    result.exit_code = out.returncode
-    result.stdout = out.stdout
-    result.stderr = out.stderr
-    result.peak_memory_kbytes = parse_peak_memory(result.stderr)
-    tool.parse_additional(result)
-    sanitize_result(tool, file, result)
-    results.add_result(tool, file, result)
+__BENCHMARKS = None
+
+
+def process_pair(pair_id: int) -> tuple[int, Result]:
+    # the benchmarks (like the options and the cgroup of the run) are inherited
+    # from the parent process when forking the workers, so only the pair id
+    # and the result have to be sent between them
+    return pair_id, process(*__BENCHMARKS.pair(pair_id))
+
+
+def number_of_jobs() -> int:
+    jobs = options.args().local_jobs
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+
+def run_pairs(
+    collector: ResultCollector, pair_ids: Sequence[int], jobs: int, progress: tqdm
+):
+    global __BENCHMARKS
+    benchmarks = collector.benchmarks
+
+    def collect(pair_id: int, result: Result):
+        tool, file = benchmarks.pair(pair_id)
+        collector.add(tool, file, result)
+        progress.update(1)
+
+    if options.args().local_executor == "asyncio":
+        executor.run_all(benchmarks, pair_ids, jobs, collect)
+    elif jobs == 1:
+        for pair_id in pair_ids:
+            collect(pair_id, process(*benchmarks.pair(pair_id)))
+    else:
+        __BENCHMARKS = benchmarks
+        try:
+            # fork explicitly, as spawn or forkserver (the default from python
+            # 3.14) would start the workers without the state of the run
+            with multiprocessing.get_context("fork").Pool(jobs) as pool:
+                for pair_id, result in pool.imap_unordered(process_pair, pair_ids):
+                    collect(pair_id, result)
+        finally:
+            __BENCHMARKS = None
 
 
 def local(benchmarks: Benchmarks):
-    results = Results()
-
-    # TODO: multiprocessing?
-    # if we write the result immediately, this could work without sharing to much data
-    # Or write the output into single files like with slurm
-    for tool, file in tqdm(
-        benchmarks.pairs, total=len(benchmarks.pairs), dynamic_ncols=True
-    ):
-        process(tool, file, results)
-
-    check_for_missing_results(benchmarks, results)
-    write_results(benchmarks, results)
+    jobs = number_of_jobs()
+    if options.args().local_cgroup:
+        cgroup.setup()
+
+    try:
+        with ResultCollector(benchmarks) as collector:
+            for _ in collector.tiers():
+                pending = collector.pending()
+                total = len(benchmarks)
+                with tqdm(
+                    total=total, initial=total - len(pending), dynamic_ncols=True
+                ) as progress:
+                    # the pairs of each resource class are run with its limits
+                    classes = limits.resource_classes(benchmarks, pending)
+                    for (timeout, memout), pair_ids in classes.items():
+                        with limits.applied(timeout, memout):
+                            run_pairs(collector, pair_ids, jobs, progress)
+    finally:
+        cgroup.teardown()
+
+    collector.finish()
@@ -0,0 +1,437 @@
+"""
+Runs a single tool with the limits of a benchmark: the memory limit, a
+wall-clock timeout and a bound on the retained output. This is shared by the
+local executors and the slurm runner, so all backends start, stop and
+measure the tools in the same way.
+
+Only the standard library is imported here besides the output capture.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import itertools
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+from .capture import BoundedCapture
+
+
+@dataclass
+class Completed:
+    """Exit code, runtime, output and resource usage of a finished tool."""
+
+    exit_code: int
+    runtime: float  # seconds
+    stdout: bytes
+    stderr: bytes
+    user_time: float  # seconds
+    system_time: float  # seconds
+    peak_memory_kbytes: int
+
+
+# The tools are spawned by this small helper, which is started once per process
+# that runs tools, so no python interpreter is started per job. On Linux, the
+# peak memory includes the memory the process had when it was forked, so
+# spawning the tools directly from benchmax would add the size of benchmax to
+# the peak memory of every tool, while the helper only adds its own ~10 MB. For each request (the job number,
+# the limits and the command line, with the pipes for stdout and stderr), the
+# helper reports the pid of the tool, and then its exit status, runtime and
+# resource usage as obtained from wait4, or only the error if it cannot be
+# started.
+REAPER = """
+import errno, os, resource, select, signal, socket, sys, time
+sock = socket.socket(fileno=int(sys.argv[1]))
+sock.set_inheritable(False)
+# benchmax stops the tools itself, and the helper when it closes the socket
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+signal.signal(signal.SIGTERM, signal.SIG_IGN)
+wakeup_r, wakeup_w = os.pipe()
+os.set_blocking(wakeup_w, False)
+signal.set_wakeup_fd(wakeup_w)
+signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+# inherited by all tools
+resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+AS_LIMIT = resource.getrlimit(resource.RLIMIT_AS)
+DEFAULT_SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGPIPE, signal.SIGXFSZ]
+started = {}
+
+
+def spawn(argv, fds):
+    # much faster than fork and exec, as the memory of the helper is not copied
+    return os.posix_spawnp(
+        argv[0],
+        argv,
+        os.environ,
+        file_actions=[(os.POSIX_SPAWN_DUP2, fds[0], 1), (os.POSIX_SPAWN_DUP2, fds[1], 2)],
+        setsid=True,
+        setsigdef=DEFAULT_SIGNALS,
+    )
+
+
+def fork(argv, fds, memout, cgroup):
+    # the tool joins the cgroup or sets its limit between fork and exec, and
+    # reports a failed exec through a pipe which is closed by a successful one
+    error_r, error_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            os.dup2(fds[0], 1)
+            os.dup2(fds[1], 2)
+            for sig in DEFAULT_SIGNALS + [signal.SIGCHLD]:
+                signal.signal(sig, signal.SIG_DFL)
+            if cgroup:
+                with open(cgroup + "/cgroup.procs", "w") as f:
+                    f.write("0")
+            elif memout > 0:
+                resource.setrlimit(resource.RLIMIT_AS, (memout * 1024, AS_LIMIT[1]))
+            os.execvp(argv[0], argv)
+        except OSError as e:
+            os.write(error_w, str(e.errno or 0).encode())
+        os._exit(127)
+    os.close(error_w)
+    try:
+        error = os.read(error_r, 16)
+    finally:
+        os.close(error_r)
+    if error:
+        os.waitpid(pid, 0)
+        raise OSError(int(error), os.strerror(int(error)))
+    return pid
+
+
+def spawn_limited(argv, fds, memout):
+    # the tool inherits the limit of the helper while it is spawned
+    resource.setrlimit(resource.RLIMIT_AS, (memout * 1024, AS_LIMIT[1]))
+    try:
+        return spawn(argv, fds)
+    except MemoryError:
+        pass
+    except OSError as e:
+        if e.errno != errno.ENOMEM:
+            raise
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, AS_LIMIT)
+    # the limit leaves the helper no room for spawning, the tool may still fit
+    return fork(argv, fds, memout, "")
+
+
+def start(request, fds):
+    job, memout, cgroup, *argv = request.decode().split("\\0")
+    memout = int(memout)
+    begin = time.monotonic()
+    try:
+        if cgroup:
+            pid = fork(argv, fds, memout, cgroup)
+        elif memout > 0:
+            pid = spawn_limited(argv, fds, memout)
+        else:
+            pid = spawn(argv, fds)
+    except OSError as e:
+        sock.send(f"error {job} {e.errno or 0}".encode())
+        return
+    started[pid] = (job, begin)
+    sock.send(f"pid {job} {pid}".encode())
+
+
+def reap():
+    while len(started) > 0:
+        # the tool stays a zombie until the rest of its process group is
+        # killed, so the id of the group is not reused in the meantime
+        info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT)
+        if info is None:
+            return
+        if info.si_pid not in started:
+            os.waitpid(info.si_pid, 0)
+            continue
+        job, begin = started.pop(info.si_pid)
+        runtime = time.monotonic() - begin
+        try:
+            os.killpg(info.si_pid, signal.SIGKILL)
+        except OSError:
+            pass
+        _, status, usage = os.wait4(info.si_pid, 0)
+        usage = f"{usage.ru_utime} {usage.ru_stime} {usage.ru_maxrss}"
+        sock.send(f"exit {job} {status} {runtime} {usage}".encode())
+
+
+poll = select.poll()
+poll.register(sock, select.POLLIN)
+poll.register(wakeup_r, select.POLLIN)
+while True:
+    for fd, _ in poll.poll():
+        if fd == wakeup_r:
+            os.read(wakeup_r, 1 << 12)
+            reap()
+            continue
+        try:
+            request, fds, _, _ = socket.recv_fds(sock, 1 << 16, 2)
+        except ConnectionError:
+            request = None
+        if not request:
+            # benchmax is gone, its tools do not outlive it
+            for pid in started:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            sys.exit()
+        start(request, fds)
+        for fd in fds:
+            os.close(fd)
+"""
+
+# process groups of the tools which are currently running in this process
+__RUNNING: set[int] = set()
+
+
+def signal_group(pgid: int, sig: int):
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def kill_cgroup(cgroup: str | None):
+    # cgroup.kill also catches processes which left the process group
+    if cgroup is None:
+        return
+    try:
+        with open(cgroup + "/cgroup.kill", "w") as f:
+            f.write("1")
+    except OSError:
+        pass
+
+
+def kill(pgid: int, cgroup: str | None):
+    signal_group(pgid, signal.SIGKILL)
+    kill_cgroup(cgroup)
+
+
+def kill_running():
+    """Kills the tools which are still running, e.g. if benchmax is stopped."""
+    for pgid in list(__RUNNING):
+        signal_group(pgid, signal.SIGKILL)
+
+
+class Reaper:
+    """
+    The helper process which spawns the tools of this process. Its reports are
+    read by the event loop which runs the tools, and passed on to the job
+    they belong to.
+    """
+
+    def __init__(self):
+        self.socket, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-I", "-S", "-c", REAPER, str(theirs.fileno())],
+                stdin=subprocess.DEVNULL,
+                pass_fds=(theirs.fileno(),),
+            )
+        finally:
+            theirs.close()
+        self.pid = os.getpid()
+        self.jobs = itertools.count()
+        self.queues: dict[int, asyncio.Queue] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def alive(self) -> bool:
+        # a forked process needs its own helper
+        return self.pid == os.getpid() and self.process.poll() is None
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        if self.loop is loop:
+            return
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.remove_reader(self.socket)
+        loop.add_reader(self.socket, self.dispatch)
+        self.loop = loop
+
+    def spawn(
+        self,
+        argv: list[str],
+        memout_kbytes: int | None,
+        cgroup: str | None,
+        stdout: int,
+        stderr: int,
+    ) -> int:
+        """Requests to start the tool and returns the number of the job."""
+        job = next(self.jobs)
+        request = "\0".join([str(job), str(memout_kbytes or 0), cgroup or "", *argv])
+        socket.send_fds(self.socket, [request.encode()], [stdout, stderr])
+        self.queues[job] = asyncio.Queue()
+        return job
+
+    def dispatch(self):
+        report = self.socket.recv(1 << 12).decode().split()
+        if len(report) == 0:
+            # the helper exited, the waiting jobs fail
+            self.loop.remove_reader(self.socket)
+            self.loop = None
+            for queue in self.queues.values():
+                queue.put_nowait(None)
+            return
+        queue = self.queues.get(int(report[1]), None)
+        if queue is not None:
+            queue.put_nowait(report)
+        elif report[0] == "pid":
+            # the job was cancelled before its tool was started
+            signal_group(int(report[2]), signal.SIGKILL)
+
+
+__REAPER: Reaper | None = None
+
+
+def reaper() -> Reaper:
+    global __REAPER
+    if __REAPER is None or not __REAPER.alive():
+        __REAPER = Reaper()
+    return __REAPER
+
+
+async def run_async(
+    argv: list[str],
+    timeout: float | None,
+    gracetime: float,
+    output_limit: int,
+    memout_kbytes: int | None = None,
+    cgroup: str | None = None,
+) -> Completed:
+    """
+    Runs the command in its own session and waits for it to finish.
+    The tool is limited to memout_kbytes of virtual memory, or attached to the
+    given cgroup which limits its memory instead. When the timeout is reached,
+    the process group of the tool receives SIGTERM, and SIGKILL after the
+    grace time. Processes of the group which outlive the tool are killed.
+    Many tools can be run at once from the same event loop.
+    Raises OSError if the tool cannot be started.
+    """
+    loop = asyncio.get_running_loop()
+    helper = reaper()
+    helper.attach(loop)
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    captures = {
+        stdout_r: BoundedCapture(output_limit),
+        stderr_r: BoundedCapture(output_limit),
+    }
+    open_pipes = set(captures)
+    drained = loop.create_future()
+
+    def close(fd: int):
+        loop.remove_reader(fd)
+        os.close(fd)
+        open_pipes.discard(fd)
+
+    def read(fd: int):
+        data = os.read(fd, 1 << 16)
+        if data:
+            captures[fd].write(data)
+            return
+        close(fd)
+        if len(open_pipes) == 0:
+            drained.set_result(None)
+
+    job = None
+    pid = None
+    error = None
+    report = None
+    timers = []
+    try:
+        try:
+            job = helper.spawn(argv, memout_kbytes, cgroup, stdout_w, stderr_w)
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+        for fd in captures:
+            loop.add_reader(fd, read, fd)
+        while report is None and error is None:
+            message = await helper.queues[job].get()
+            if message is None:
+                raise OSError("the helper process which runs the tools exited")
+            kind, _, *fields = message
+            if kind == "pid":
+                pid = int(fields[0])
+                __RUNNING.add(pid)
+                if timeout is not None:
+                    # the timeout starts when the tool is forked
+                    timers = [
+                        loop.call_later(timeout, signal_group, pid, signal.SIGTERM),
+                        loop.call_later(timeout + gracetime, kill, pid, cgroup),
+                    ]
+            elif kind == "error":
+                error = int(fields[0])
+            else:
+                report = fields
+                # the tool is reaped, its process group id may be reused
+                for timer in timers:
+                    timer.cancel()
+                __RUNNING.discard(pid)
+        if len(open_pipes) > 0:
+            # the pipes may be held by a process which left the group
+            try:
+                await asyncio.wait_for(drained, gracetime)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for timer in timers:
+            timer.cancel()
+        for fd in list(open_pipes):
+            close(fd)
+        if report is None and pid is not None:
+            # the wait was interrupted, the tool does not outlive it
+            signal_group(pid, signal.SIGKILL)
+            __RUNNING.discard(pid)
+        helper.queues.pop(job, None)
+    if error is not None:
+        raise OSError(error, os.strerror(error), argv[0])
+    status, runtime, user_time, system_time, peak = report
+    return Completed(
+        os.waitstatus_to_exitcode(int(status)),
+        float(runtime),
+        captures[stdout_r].getvalue(),
+        captures[stderr_r].getvalue(),
+        float(user_time),
+        float(system_time),
+        # ru_maxrss is given in kilobytes on Linux
+        int(peak),
+    )
+
+
+__LOOP: asyncio.AbstractEventLoop | None = None
+__LOOP_PID: int | None = None
+
+
+def run(
+    argv: list[str],
+    timeout: float | None,
+    gracetime: float,
+    output_limit: int,
+    memout_kbytes: int | None = None,
+    cgroup: str | None = None,
+) -> Completed:
+    """Same as run_async(), for processes which run one tool at a time."""
+    global __LOOP, __LOOP_PID
+    # a forked process needs its own event loop
+    if __LOOP is None or __LOOP_PID != os.getpid():
+        __LOOP = asyncio.new_event_loop()
+        __LOOP_PID = os.getpid()
+    job = __LOOP.create_task(
+        run_async(argv, timeout, gracetime, output_limit, memout_kbytes, cgroup)
+    )
+    try:
+        return __LOOP.run_until_complete(job)
+    except BaseException:
+        # e.g. ctrl-c, which leaves the event loop in the middle of the job
+        kill_running()
+        if not job.done():
+            job.cancel()
+            try:
+                __LOOP.run_until_complete(job)
+            except asyncio.CancelledError:
+                pass
+        raise
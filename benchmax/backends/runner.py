@@ -0,0 +1,291 @@
+"""
+Runs one slice of a slurm array job on the compute node.
+
+The runner is started once per array task. It reads its slice of the jobs
+file at the byte offsets given by the index file and runs the jobs one
+after another, or up to --jobs of them at once in worker processes,
+with the limits, timeout and measurements shared with the local backend
+(see process.py). In the work queue mode (--queue), the runner instead claims one
+slice after another from a counter shared by all array tasks, until all
+slices are claimed. The tools and options of the run are loaded from the
+context file written by benchmax, so the output is parsed on the node and
+only one JSON record per job is written to the records file. An empty done
+file is written next to the records file when the task is finished.
+
+The runner imports benchmax from the installation of the submitting
+process (see package_root() in slurm.py), so the compute nodes need access to
+it, but not to any package besides the standard library.
+"""
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import fcntl
+import json
+import multiprocessing
+import os
+import pickle
+import shlex
+import signal
+import struct
+import sys
+from typing import Iterator
+
+from .. import options
+from . import process
+from .backends import run_tool
+from ..results.Journal import result_to_dict, tool_key
+from ..results.Result import Result
+from ..tools.Tool import Tool
+
+# the index file contains the byte offset and the number of the first job of
+# each slice (and of the end of the jobs file) as unsigned 64 bit integers
+SLICE = struct.Struct("<QQ")
+
+# the counter of the work queue is an unsigned 64 bit integer
+COUNTER = struct.Struct("<Q")
+
+
+def write_index(filename: str, slices: list[tuple[int, int]]):
+    with open(filename, "wb") as f:
+        for offset, first_job in slices:
+            f.write(SLICE.pack(offset, first_job))
+
+
+def write_context(filename: str, tools: list[Tool]):
+    with open(filename, "wb") as f:
+        pickle.dump({"options": options.args(), "tools": tools}, f)
+
+
+def job_line(pair_id: int, tool_id: int, file: str) -> str:
+    return f"{pair_id}\t{tool_id}\t{file}\n"
+
+
+def parse_job_line(line: str) -> tuple[int, int, str]:
+    pair_id, tool_id, file = line.split("\t", 2)
+    return int(pair_id), int(tool_id), file
+
+
+def read_slice(jobs_file: str, index_file: str, task: int) -> tuple[int, list[str]]:
+    """
+    Returns the number of the first job and the lines of the jobs file of the
+    given (1-based) slice.
+    """
+    with open(index_file, "rb") as f:
+        f.seek((task - 1) * SLICE.size)
+        start, first_job = SLICE.unpack(f.read(SLICE.size))
+        end, _ = SLICE.unpack(f.read(SLICE.size))
+    with open(jobs_file, "rb") as f:
+        f.seek(start)
+        return first_job, f.read(end - start).decode().split("\n")[:-1]
+
+
+def slice_count(index_file: str) -> int:
+    return os.path.getsize(index_file) // SLICE.size - 1
+
+
+def claim(counter_file: str) -> int:
+    """
+    Increments the counter shared by all array tasks and returns its previous
+    value. The counter is protected by a POSIX lock, which also works on
+    shared file systems like NFS.
+    """
+    fd = os.open(counter_file, os.O_RDWR)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        data = os.pread(fd, COUNTER.size, 0)
+        value = COUNTER.unpack(data)[0] if len(data) == COUNTER.size else 0
+        os.pwrite(fd, COUNTER.pack(value + 1), 0)
+        os.fsync(fd)
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+    return value
+
+
+def static_jobs(
+    jobs_file: str, index_file: str, task: int
+) -> Iterator[tuple[int, str]]:
+    """Yields the number and line of each job of the slice of the array task."""
+    first_job, lines = read_slice(jobs_file, index_file, task)
+    yield from enumerate(lines, start=first_job)
+
+
+def queued_jobs(
+    jobs_file: str, index_file: str, counter_file: str
+) -> Iterator[tuple[int, str]]:
+    """
+    Yields the number and line of each job of the slices claimed from the work
+    queue. The next slice is only claimed when its first job is requested.
+    """
+    slices = slice_count(index_file)
+    while True:
+        s = claim(counter_file)
+        if s >= slices:
+            return
+        first_job, lines = read_slice(jobs_file, index_file, s + 1)
+        yield from enumerate(lines, start=first_job)
+
+
+def format_output(
+    i: int, cmd: str, stdout: bytes, stderr: bytes
+) -> tuple[bytes, bytes]:
+    """Returns the raw output of a job as written to the log files of the array task."""
+    out = f"Executing {cmd}\n# START {i} #\n".encode() + stdout
+    out += f"\n# END {i} #\n".encode()
+    err = f"# START {i} #\n".encode() + stderr + f"\n# END {i} #\n".encode()
+    return out, err
+
+
+def write_output(out: bytes, err: bytes):
+    sys.stdout.buffer.write(out)
+    sys.stderr.buffer.write(err)
+    sys.stdout.buffer.flush()
+    sys.stderr.buffer.flush()
+
+
+def run_job(
+    tool: Tool, file: str, i: int, keep_output: bool
+) -> tuple[Result, tuple[bytes, bytes] | None]:
+    """Runs the job and returns its result and, if requested, its raw output."""
+    cmd = tool.get_command_line(file)
+    result, completed = run_tool(tool, file, shlex.split(cmd))
+    output = None
+    if keep_output:
+        output = format_output(i, cmd, completed.stdout, completed.stderr)
+    return result, output
+
+
+__TOOLS: list[Tool] = []
+__KEEP_OUTPUT = False
+
+
+def run_line(job: tuple[int, str]) -> tuple[str | None, tuple[bytes, bytes] | None]:
+    """
+    Runs the job given by a line of the jobs file and returns its record, or
+    None if the tool could not be started.
+    """
+    i, line = job
+    pair_id, tool_id, file = parse_job_line(line)
+    tool = __TOOLS[tool_id]
+    try:
+        result, output = run_job(tool, file, i, __KEEP_OUTPUT)
+    except OSError as e:
+        # e.g. the tool is not accessible on this node; the job is left
+        # without record, so that benchmax submits it again
+        print(f"failed to run job {i}: {e}", file=sys.stderr, flush=True)
+        return None, None
+    record = {
+        "pair": pair_id,
+        "file": file,
+        "tool": tool_key(tool),
+        "job": i,
+        "result": result_to_dict(result),
+    }
+    return json.dumps(record) + "\n", output
+
+
+def stop(signum, frame):
+    """
+    Kills the running tools when the runner is terminated by slurm or the job
+    script. The tools run in their own sessions, so the signal does not reach
+    them. The records of finished jobs are flushed when the records file is
+    closed on the way out, and no done file is written.
+    """
+    process.kill_running()
+    for worker in multiprocessing.active_children():
+        worker.terminate()
+    raise SystemExit(128 + signum)
+
+
+def stop_worker(signum, frame):
+    process.kill_running()
+    os._exit(128 + signum)
+
+
+def init_worker(tools: list[Tool], keep_output: bool, args: argparse.Namespace):
+    # the state of the runner is passed explicitly, as the workers are not
+    # forked with every start method
+    global __TOOLS, __KEEP_OUTPUT
+    options.set_args(args)
+    __TOOLS = tools
+    __KEEP_OUTPUT = keep_output
+    signal.signal(signal.SIGTERM, stop_worker)
+
+
+def run_jobs(
+    jobs: Iterator[tuple[int, str]], concurrency: int
+) -> Iterator[tuple[str | None, tuple[bytes, bytes] | None]]:
+    """
+    Runs the jobs, up to the given number at once, and yields their records.
+    A job is only taken from the iterator when it can be started right away,
+    so that the work queue is not drained ahead of time.
+    """
+    if concurrency == 1:
+        yield from map(run_line, jobs)
+        return
+    # each worker runs one job at a time, the records are written by this
+    # process only
+    with ProcessPoolExecutor(
+        concurrency,
+        initializer=init_worker,
+        initargs=(__TOOLS, __KEEP_OUTPUT, options.args()),
+    ) as pool:
+        running = set()
+        for job in jobs:
+            running.add(pool.submit(run_line, job))
+            if len(running) == concurrency:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(running).done:
+            yield future.result()
+
+
+def main():
+    global __TOOLS, __KEEP_OUTPUT
+    parser = argparse.ArgumentParser(description="run a slice of benchmax jobs")
+    parser.add_argument("context_file")
+    parser.add_argument("jobs_file")
+    parser.add_argument("index_file")
+    parser.add_argument("records", help="prefix of the records file")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--queue", help="counter file of the work queue")
+    parser.add_argument(
+        "--task-offset",
+        type=int,
+        default=0,
+        help="number of the tasks in the previous array jobs of the run",
+    )
+    parser.add_argument("--keep-output", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.context_file, "rb") as f:
+        context = pickle.load(f)
+    options.set_args(context["options"])
+    __TOOLS = context["tools"]
+    __KEEP_OUTPUT = args.keep_output
+
+    signal.signal(signal.SIGTERM, stop)
+    task = int(os.environ["SLURM_ARRAY_TASK_ID"])
+    if args.queue is None:
+        jobs = static_jobs(args.jobs_file, args.index_file, task + args.task_offset)
+    else:
+        jobs = queued_jobs(args.jobs_file, args.index_file, args.queue)
+
+    # creating the records file marks the task as started and the done file
+    # marks it as finished, so its progress can be followed by listing the
+    # directory instead of asking slurm
+    records_base = f"{args.records}.{os.environ['SLURM_ARRAY_JOB_ID']}_{task}"
+    with open(records_base + ".jsonl", "a") as records:
+        for record, output in run_jobs(jobs, args.jobs):
+            if output is not None:
+                write_output(*output)
+            if record is None:
+                continue
+            records.write(record)
+            records.flush()
+    open(records_base + ".done", "w").close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,161 @@
 from dataclasses import dataclass
 from datetime import timedelta
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import glob
+import json
 import logging
 import math
 import multiprocessing
 import os
 from pathlib import Path
 import re
+import sys
+import tarfile
 import time
 from tqdm import tqdm
+from typing import Callable, Sequence
 
 from .backends import *
+from .runner import COUNTER, job_line, write_context, write_index
 from ..BenchmaxException import BenchmaxException
 from ..benchmarks import Benchmarks
-from .. import options
+from .. import limits, options
+from ..results.Journal import result_from_dict, tool_key
+from ..scheduling import plan_slices
 
+# number of slices per concurrent job in the work queue mode; more slices
+# shorten the tail at the end of the array job, but the shared counter is
+# updated more often
+QUEUE_SLICES_PER_WORKER = 100
 
-def generate_jobs_file(filename: str, benchmarks: Benchmarks):
+# seconds before the time limit at which slurm signals a task with staged
+# logs to copy them back
+STAGE_SIGNAL_SECONDS = 120
+
+# seconds between two listings of the records and done files of the tasks
+COLLECT_PERIOD_S = 5
+
+# seconds without progress of the tasks before slurm is asked about the array
+# jobs, doubled after every query up to the maximum
+QUERY_BACKOFF_S = 60
+QUERY_BACKOFF_MAX_S = 960
+
+# new records of at most this many bytes are parsed by benchmax itself, more
+# are parsed by a pool of worker processes, e.g. in the final collection
+INLINE_PARSE_BYTES = 1 << 24
+
+
+def split(pair_ids: Sequence[int], slice_size: int) -> list[Sequence[int]]:
+    return [pair_ids[i : i + slice_size] for i in range(0, len(pair_ids), slice_size)]
+
+
+def generate_jobs_file(
+    filename: str, benchmarks: Benchmarks, slices: list[Sequence[int]]
+) -> str:
+    """
+    Writes the pair id, tool index and file of the pairs of all slices to the
+    jobs file, and the byte offset and first job of each slice to an index
+    file, whose name is returned.
+    """
     logging.info("writing slurm jobs file to " + filename)
-    with open(filename, "w+") as f:
-        f.writelines(
-            [tool.get_command_line(file) + "\n" for tool, file in benchmarks.pairs]
-        )
+    index = []
+    # the jobs are numbered from 1 like the lines of the jobs file
+    job = 1
+    with open(filename, "wb") as f:
+        for pair_ids in slices:
+            index.append((f.tell(), job))
+            for pair_id in pair_ids:
+                tool_id = benchmarks.tool_ids[pair_id]
+                f.write(job_line(pair_id, tool_id, benchmarks.file(pair_id)).encode())
+            job += len(pair_ids)
+        index.append((f.tell(), job))
+    index_filename = filename + ".index"
+    write_index(index_filename, index)
+    return index_filename
 
 
 @dataclass
 class ChunkArgs:
     file_suffix: str
+    log_prefix: str
+    filename_context: str
     filename_joblist: str
+    filename_index: str
     tmp_dir: str
     limit_time: timedelta
     grace_time: timedelta
     limit_mem_kb: int  # TODO memory type?
     array_size: int
     slice_size: int
-    n_tasks: int
+    cpus_per_task: int
+    time_limit: float | None  # seconds, estimated from the slice size if None
+    filename_queue: str | None  # counter of the work queue mode
 
 
 def generate_submit_file_chunked(args: ChunkArgs) -> str:
     filename = f"{args.tmp_dir}/job-{args.file_suffix}.job"
     logging.info(f"generating submit file {filename}")
 
-    # rough estimation of required time
-    timeout = options.args().timeout + options.args().gracetime
-    minutes = args.slice_size * timeout / 30
+    if args.time_limit is None:
+        # rough estimation of required time
+        timeout = options.args().timeout + options.args().gracetime
+        minutes = math.ceil(args.slice_size / args.cpus_per_task) * timeout / 30
+    else:
+        minutes = args.time_limit / 60
+    if options.args().slurm_stage_logs:
+        # the task is signalled to copy its logs back this long before the
+        # time limit, which must not cut into the time of the slice
+        minutes += STAGE_SIGNAL_SECONDS / 60
+    if minutes > 60 * 24:
+        logging.warning("the slices may not finish within the maximum time of 24h")
     estimate = int(min(minutes + 1, 60 * 24))
 
+    records_prefix = f"{args.tmp_dir}/{args.log_prefix}"
+    output = f"{args.tmp_dir}/{args.log_prefix}.%A_%a"
+    out, err = output + ".out", output + ".err"
+    stage = []
+    if options.args().slurm_stage_logs:
+        # the logs are written to the node and copied back as one bundle,
+        # which appears atomically, when the runner ends or is stopped
+        # because of the time limit
+        records_prefix = f"$logs/{args.log_prefix}"
+        out, err = "/dev/null", "/dev/null"
+        stage = [
+            f"#SBATCH --signal=B:USR1@{STAGE_SIGNAL_SECONDS}\n",
+            f"name={args.log_prefix}.${{SLURM_ARRAY_JOB_ID}}_${{SLURM_ARRAY_TASK_ID}}\n",
+            "logs=${TMPDIR:-/tmp}/benchmax.$name\n",
+            f"bundle={args.tmp_dir}/$name.tgz\n",
+            "mkdir -p $logs\n",
+            "exec > $logs/$name.out 2> $logs/$name.err\n",
+            f"touch {args.tmp_dir}/$name.started\n",
+            "bundle() {\n",
+            "  tar -czf $bundle.part -C $logs . && mv $bundle.part $bundle\n",
+            "  rm -rf $logs\n",
+            "}\n",
+            "stop() {\n",
+            "  kill -TERM $runner\n",
+            "  wait $runner\n",
+            "  bundle\n",
+            "  exit 1\n",
+            "}\n",
+            "trap stop USR1 TERM\n",
+        ]
+    runner = [
+        f"{sys.executable} -m benchmax.backends.runner",
+        f" {args.filename_context} {args.filename_joblist}",
+        f" {args.filename_index} {records_prefix}",
+        f" --jobs {args.cpus_per_task} --task-offset $1",
+        f" --queue {args.filename_queue}" if args.filename_queue else "",
+        " --keep-output" if options.args().slurm_keep_output else "",
+    ]
+    if options.args().slurm_stage_logs:
+        # the runner runs in the background, so that the trap is not delayed
+        run = [*runner, " &\n", "runner=$!\n", "wait $runner\n", "bundle\n"]
+    else:
+        run = ["exec ", *runner, "\n"]
+
     with open(filename, "w+") as f:
         f.writelines(
             [
@@ -56,162 +165,429 @@ def generate_submit_file_chunked(args: ChunkArgs) -> str:
                 "### Job name\n",
                 "#SBATCH --job-name=benchmax\n",
                 # output files
-                "#SBATCH -o " + args.tmp_dir + "/JOB.%A_%a.out\n",
-                "#SBATCH -e " + args.tmp_dir + "/JOB.%A_%a.err\n",
+                "#SBATCH -o " + out + "\n",
+                "#SBATCH -e " + err + "\n",
                 # required time
                 "#SBATCH -t " + str(estimate) + "\n",
-                # memory usage
+                # one cpu per concurrent job
+                f"#SBATCH --cpus-per-task {args.cpus_per_task}\n",
+                # memory usage, per cpu and thus per concurrent job
                 "#SBATCH --mem-per-cpu ",
                 str(math.ceil(args.limit_mem_kb / 1000) + 1024) + "M\n",
+                # stage the logs on the node
+                *stage,
                 # load environment
                 "source " + options.args().slurm_env + "\n",
                 # change dir
                 "cd " + args.tmp_dir + "\n",
-                # calculate slices
-                "min=$SLURM_ARRAY_TASK_MIN\n",
-                "max=$SLURM_ARRAY_TASK_MAX\n",
-                "cur=$SLURM_ARRAY_TASK_ID\n",
-                "slicesize=" + str(args.slice_size) + "\n",
-                f"start=$(( (cur - 1) * slicesize + 1 ))\n",
-                f"end=$(( start + slicesize - 1 ))\n",
-                f"end=$(( end<{args.n_tasks} ? end : {args.n_tasks}))\n",
-                # Execute this slice
-                "for i in `seq ${start} ${end}`; do\n",
-                "lineidx=$(( i ))\n",
-                '\tcmd=$(time sed -n "${lineidx}p" < ' + args.filename_joblist + ")\n",
-                '\techo "Executing $cmd"\n',
-                '\techo "# START ${i} #"\n',
-                '\techo "# START ${i} #" >&2\n',
-                '\tstart=`date +"%s%3N"`\n',
-                "\tulimit -c 0 && ulimit -S -v " + str(args.limit_mem_kb),
-                " && eval /usr/bin/time -v timeout --signal=TERM",
-                " --preserve-status " + str(timeout) + "s  $cmd ; rc=$?" + "\n",
-                '\tend=`date +"%s%3N"`\n',
-                '\techo "# END ${i} #"\n',
-                '\techo "# END ${i} #" 1>&2\n',
-                '\techo "time: $(( end - start ))"\n',
-                '\techo "exitcode: $rc"\n',
-                '\techo "# END DATA ${i} #"\n',
-                "done\n",
+                # execute this slice
+                f"export PYTHONPATH={package_root()}${{PYTHONPATH:+:$PYTHONPATH}}\n",
+                *run,
             ]
         )
     return filename
 
 
-def run_job(jobs: Benchmarks, array_size: int, slice_size: int) -> int:
-    jobs_filename = (
-        f"{options.args().slurm_tmp_dir}/jobs-{options.args().start_time}.jobs"
-    )
-
-    generate_jobs_file(jobs_filename, jobs)
+def package_root() -> str:
+    # the runner is imported from the same installation as benchmax
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+def log_prefix(tier: int) -> str:
+    # separate logs per tier, as the results of a pair differ between tiers
+    return f"JOB.t{tier}"
+
+
+def run_job(
+    benchmarks: Benchmarks,
+    slices: list[Sequence[int]],
+    tasks: int,
+    time_limit: float | None,
+    tier: int,
+    retry: int,
+    resource_class: int,
+    job_ids: list[int],
+) -> str | None:
+    """
+    Submits the slices as array jobs with the given total number of tasks.
+    The tasks are split into array jobs of at most --slurm.array-size tasks,
+    whose ids are appended to job_ids as soon as they are submitted.
+    Returns the counter file of the work queue, if any.
+    """
+    file_suffix = f"{options.args().start_time}-t{tier}"
+    if len(limits.rules()) > 0:
+        file_suffix += f"-c{resource_class}"
+    if retry > 0:
+        file_suffix += f"-r{retry}"
+    jobs_filename = f"{options.args().slurm_tmp_dir}/jobs-{file_suffix}.jobs"
+
+    index_filename = generate_jobs_file(jobs_filename, benchmarks, slices)
+    context_filename = f"{options.args().slurm_tmp_dir}/context-{file_suffix}.pickle"
+    write_context(context_filename, benchmarks.tools)
+
+    queue_filename = None
+    jobs_per_task = max(len(pair_ids) for pair_ids in slices)
+    if options.args().slurm_work_queue:
+        queue_filename = f"{options.args().slurm_tmp_dir}/queue-{file_suffix}.counter"
+        with open(queue_filename, "wb") as f:
+            f.write(COUNTER.pack(0))
+        jobs = sum(len(pair_ids) for pair_ids in slices)
+        jobs_per_task = math.ceil(jobs / tasks)
 
     submitfile = generate_submit_file_chunked(
         ChunkArgs(
-            str(options.args().start_time),
+            file_suffix,
+            log_prefix(tier),
+            context_filename,
             jobs_filename,
+            index_filename,
             options.args().slurm_tmp_dir,
             options.args().timeout,
             options.args().gracetime,
             options.args().memout,
-            array_size,
-            slice_size,
-            len(jobs),
+            min(tasks, options.args().slurm_array_size),
+            jobs_per_task,
+            options.args().slurm_cpus_per_task,
+            time_limit,
+            queue_filename,
         )
     )
 
-    logging.info("submitting job now")
-
-    res = call_program(
-        f"sbatch --array=1-{array_size} "
-        + options.args().slurm_sbatch_options
-        + " "
-        + submitfile
-    )
-    # TODO: what if slurm does not work at all?
-
-    job_id = re.search("Submitted batch job ([0-9]+)", res.stdout)
-    if job_id is None:
-        raise BenchmaxException(
-            "unable to obtain job id from slurm output: " + str(res.stdout)
+    for offset in range(0, tasks, options.args().slurm_array_size):
+        indices = f"1-{min(options.args().slurm_array_size, tasks - offset)}"
+        if options.args().slurm_throttle:
+            # limit the number of simultaneously running tasks
+            indices += f"%{options.args().slurm_throttle}"
+        dependency = ""
+        if options.args().slurm_chain and len(job_ids) > 0:
+            dependency = f"--dependency=afterany:{job_ids[-1]} "
+        logging.info("submitting job now")
+
+        # the offset of the array tasks is passed to the submit file
+        res = call_program(
+            f"sbatch --array={indices} "
+            + dependency
+            + options.args().slurm_sbatch_options
+            + " "
+            + submitfile
+            + f" {offset}"
         )
-    return int(job_id.group(1))
-
+        # TODO: what if slurm does not work at all?
+
+        job_id = re.search("Submitted batch job ([0-9]+)", res.stdout)
+        if job_id is None:
+            raise BenchmaxException(
+                "unable to obtain job id from slurm output: " + str(res.stdout)
+            )
+        job_ids.append(int(job_id.group(1)))
+        logging.info(f"job {job_ids[-1]} scheduled.")
+    return queue_filename
+
+
+def job_finished(job_ids: list[int]) -> bool:
+    finished_states = [
+        "COMPLETED",
+        "CANCELLED",
+        "TIMEOUT",
+        "FAILED",
+        "NODE_FAIL",
+        "OUT_OF_MEMORY",
+        "BOOT_FAIL",
+        "DEADLINE",
+        "PREEMPTED",
+    ]
+    cmd = "sacct --noheader -o state  -j " + ",".join(map(str, job_ids))
+    output = call_program(cmd)
+    for line in output.stdout.splitlines():
+        if len(line) <= 1:
+            continue
+        if not any([state in line for state in finished_states]):
+            return False
+    return True
 
-def parse_chunk(jobs: Benchmarks, out_file: str, results: Results):
-    logging.debug(f"Processing file {out_file}")
-    with open(out_file, "r") as f:
-        content_out = f.read()
-    with open(out_file.replace(".out", ".err"), "r") as f:
-        content_err = f.read()
 
-    pattern_out = re.compile(
-        r"Executing (.+)\n# START ([0-9]+) #([\s\S]*)# END \2 #(?:([\s\S]*)# END DATA \2 #)?"
-    )
-    pattern_err = re.compile(
-        r"# START ([0-9]+) #([\s\S]*)# END \1 #(?:([\s\S]*)# END DATA \1 #)?"
+def log_task_states(job_ids: list[int]):
+    """
+    Reports the array tasks which ended without completing, e.g. due to a
+    node failure. Tasks which are still pending, running or completing (as
+    the last ones may be while the results are collected) are not reported.
+    """
+    failed_states = [
+        "CANCELLED",
+        "TIMEOUT",
+        "FAILED",
+        "NODE_FAIL",
+        "OUT_OF_MEMORY",
+        "BOOT_FAIL",
+        "DEADLINE",
+        "PREEMPTED",
+    ]
+    cmd = "sacct --noheader --allocations --parsable2 -o state -j "
+    cmd += ",".join(map(str, job_ids))
+    output = call_program(cmd)
+    # states like "CANCELLED by 1234" carry additional information
+    states = Counter(
+        state
+        for state in (line.split(" ")[0] for line in output.stdout.splitlines())
+        if state in failed_states
     )
+    if len(states) > 0:
+        summary = ", ".join(f"{n} {state}" for state, n in states.most_common())
+        logging.warning(f"array tasks which did not complete: {summary}")
 
-    for m_out, m_err in zip(
-        pattern_out.finditer(content_out), pattern_err.finditer(content_err)
-    ):
-        res = Result()
-
-        # gather tool and file from command
-        cmd = m_out.group(1)
-        logging.debug(f"Processing command {cmd}")
-        tool_found = False
-        for tool in jobs.tools:
-            p = tool.parse_command_line(cmd)
-            if p is not None:
-                used_tool = tool
-                used_input = p
-                tool_found = True
-                break
-        if not tool_found:
-            logging.warning(f"could not find tool for {cmd} from {out_file}")
-
-        # output
-        res.stdout = m_out.group(3)
-
-        # exitcode
-        match_e = re.search("exitcode: (.*)", m_out.group(4))
-        if match_e is None:
-            logging.warning(f"did not find exitcode in {m_out.group(4)}")
-        else:
-            res.exit_code = int(match_e.group(1))
 
-        # runtime
-        match_t = re.search("time: (.*)", m_out.group(4))
-        if match_t is None:
-            logging.warning(f"did not find time in {m_out.group(4)}")
-        else:
-            res.runtime = timedelta(milliseconds=int(match_t.group(1)))
+def read_bundle(bundle_file: str) -> bytes:
+    """Returns the contents of the records file in the bundle of a task."""
+    with tarfile.open(bundle_file, "r:gz") as tar:
+        for member in tar:
+            if member.name.endswith(".jsonl"):
+                return tar.extractfile(member).read()
+    return b""
 
-        res.stderr = m_err.group(2)
-        res.peak_memory_kbytes = parse_peak_memory(res.stderr)
 
-        tool.parse_additional(res)
-        sanitize_result(used_tool, used_input, res)
-        res.stdout = ""
-        res.stderr = ""
-        results.add_result(used_tool, used_input, res)
+def parse_lines(data: bytes, records_file: str) -> list[tuple[int, str, tuple, Result]]:
+    results = []
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # the last record is incomplete if the task was killed
+            logging.warning(f"skipping corrupt record in {records_file}")
+            continue
+        result = result_from_dict(record["result"])
+        tool = tuple(record.get("tool", ()))
+        results.append((record["pair"], record["file"], tool, result))
+    return results
+
+
+def parse_records(
+    records_file: str, offset: int, final: bool
+) -> tuple[str, int, list[tuple[int, str, tuple, Result]]]:
+    """
+    Returns the pair id, file, tool key and result of each record in the file
+    after the given offset, and the offset up to which the file has been read.
+    Unless the array job is finished, a trailing incomplete record is left
+    for later, as the task may be writing it right now.
+    """
+    logging.debug(f"Processing file {records_file} from {offset}")
+    if records_file.endswith(".tgz"):
+        # the bundle of a staged task is complete and read at once, the
+        # offset is its size, which does not change anymore
+        data = read_bundle(records_file)
+        return (
+            records_file,
+            os.path.getsize(records_file),
+            parse_lines(data, records_file),
+        )
+    with open(records_file, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = len(data) if final else data.rfind(b"\n") + 1
+    return records_file, offset + end, parse_lines(data[:end], records_file)
 
 
-def job_finished(job_id: int) -> bool:
-    finished_states = ["COMPLETED", "CANCELLED", "TIMEOUT"]
-    cmd = "sacct --noheader -o state  -j " + str(job_id)
-    output = call_program(cmd)
-    for line in output.stdout.splitlines():
-        if len(line) <= 1:
-            continue
-        if not any([state in line for state in finished_states]):
-            return False
-    return True
+def parse_records_task(task: tuple[str, int, bool]):
+    return parse_records(*task)
 
 
-def monitor_progress(total_tasks: int, job_id: int):
-    update_period_s = 30
+class RecordsReader:
+    """
+    Collects the results from the records files of the array tasks. The files
+    are read incrementally, so the results of finished jobs can be collected
+    while the array job is still running.
+    """
 
+    def __init__(
+        self, benchmarks: Benchmarks, tmp_dir: str, collector: ResultCollector
+    ):
+        self.benchmarks = benchmarks
+        self.tmp_dir = tmp_dir
+        self.collector = collector
+        # offset up to which each records file has been read
+        self.offsets: dict[str, int] = {}
+        # array tasks ("<job>_<task>") which are started or finished according
+        # to their records, marker or bundle files
+        self.started: set[str] = set()
+        self.finished: set[str] = set()
+        self.bundles: set[str] = set()
+        # finished tasks whose records have been read completely
+        self.complete: set[str] = set()
+
+    def scan(self) -> list[tuple[str, bool, int]]:
+        """
+        Lists the directory for the records, marker and bundle files of the
+        array tasks of the current tier, and returns the records files which
+        have grown since they were read, whether their task is finished and
+        their size.
+        Only the records files of unfinished tasks are checked for new records.
+        """
+        prefix = f"{log_prefix(self.collector.tier)}."
+        with os.scandir(self.tmp_dir) as entries:
+            for entry in entries:
+                if not entry.name.startswith(prefix):
+                    continue
+                task, _, extension = entry.name[len(prefix) :].rpartition(".")
+                if extension in ["jsonl", "started"]:
+                    self.started.add(task)
+                elif extension == "done":
+                    self.finished.add(task)
+                elif extension == "tgz":
+                    # staged tasks copy their bundle back when they end
+                    self.bundles.add(task)
+                    self.finished.add(task)
+        files = []
+        for task in (self.started | self.bundles) - self.complete:
+            extension = "tgz" if task in self.bundles else "jsonl"
+            f = f"{self.tmp_dir}/{prefix}{task}.{extension}"
+            finished = task in self.finished
+            try:
+                size = os.path.getsize(f)
+            except OSError:
+                continue
+            if size > self.offsets.get(f, 0):
+                files.append((f, finished, size))
+            elif finished:
+                self.complete.add(task)
+        return files
+
+    def task_counts(self, job_ids: list[int]) -> tuple[int, int]:
+        """Returns the number of started and finished tasks of the array jobs."""
+        jobs = set(map(str, job_ids))
+
+        def count(tasks: set[str]) -> int:
+            return sum(1 for task in tasks if task.split("_")[0] in jobs)
+
+        return count(self.started | self.finished), count(self.finished)
+
+    def collect(
+        self,
+        final: bool,
+        journal: bool,
+        callback: Callable[[int, Result], None] | None = None,
+    ) -> int:
+        """
+        Parses the records which were added since the last call and returns
+        the number of new results. Large amounts of records are parsed in
+        parallel by a pool of worker processes, while the few records of a
+        regular check during the run are parsed directly.
+        Records of pairs which already have a result in the current tier,
+        e.g. of requeued tasks, are ignored.
+        """
+        files = self.scan()
+        if len(files) == 0:
+            return 0
+        tasks = [(f, self.offsets.get(f, 0), final or done) for f, done, _ in files]
+        new_bytes = sum(size - self.offsets.get(f, 0) for f, _, size in files)
+        collected = 0
+        with ExitStack() as stack:
+            if len(files) > 1 and new_bytes > INLINE_PARSE_BYTES:
+                # fork explicitly, a spawned worker would import this module
+                # on its own, which is not possible without benchmax.options
+                workers = min(len(files), os.cpu_count() or 1)
+                pool = stack.enter_context(
+                    multiprocessing.get_context("fork").Pool(workers)
+                )
+                parsed = pool.imap_unordered(parse_records_task, tasks)
+            else:
+                parsed = map(parse_records_task, tasks)
+            for f, offset, results in tqdm(
+                parsed,
+                total=len(files),
+                desc="parsing results",
+                ncols=100,
+                dynamic_ncols=True,
+                disable=not final,
+            ):
+                self.offsets[f] = offset
+                for pair_id, file, tool, result in results:
+                    if self.add(pair_id, file, tool, result, journal):
+                        collected += 1
+                        if callback is not None:
+                            callback(pair_id, result)
+        return collected
+
+    def add(
+        self, pair_id: int, file: str, key: tuple, result: Result, journal: bool
+    ) -> bool:
+        # the records of an earlier invocation refer to its pair ids, which
+        # differ if the input files or the tools changed in the meantime
+        if pair_id >= len(self.benchmarks) or self.benchmarks.file(pair_id) != file:
+            logging.warning(f"skipping result for {file} of unknown pair")
+            return False
+        tool = self.benchmarks.tools[self.benchmarks.tool_ids[pair_id]]
+        if tool_key(tool) != key:
+            logging.warning(f"skipping result for {file} of another tool")
+            return False
+        if not self.collector.needs_run(self.collector.results.get(tool, file)):
+            return False
+        self.collector.add(tool, file, result, journal=journal)
+        return True
+
+
+class ToolProgress:
+    """Progress bars with the number of results of each answer per tool."""
+
+    def __init__(self, benchmarks: Benchmarks, pair_ids: Sequence[int], position: int):
+        totals = Counter(benchmarks.tool_ids[i] for i in pair_ids)
+        self.answers = {tool_id: Counter() for tool_id in totals}
+        self.bars = {}
+        for tool_id in sorted(totals):
+            tool = benchmarks.tools[tool_id]
+            name = tool.binary.removeprefix(options.args().common_tool_prefix)
+            self.bars[tool_id] = tqdm(
+                total=totals[tool_id],
+                position=position + len(self.bars),
+                desc=f"{name} {tool.arguments}".strip(),
+                ncols=100,
+                dynamic_ncols=True,
+            )
+
+    def update(self, tool_id: int, result: Result):
+        self.answers[tool_id][result.answer] += 1
+        self.bars[tool_id].update(1)
+
+    def refresh(self):
+        for tool_id, bar in self.bars.items():
+            answers = self.answers[tool_id].most_common()
+            bar.set_postfix_str(", ".join(f"{a} {n}" for a, n in answers))
+
+    def close(self):
+        for bar in self.bars.values():
+            bar.close()
+
+
+def query_active_tasks(job_ids: list[int]) -> int | None:
+    """
+    Returns the number of pending and running tasks of the array jobs, which
+    are queried all at once, or None if slurm did not answer.
+    """
+    req = "squeue --noheader --array --states=PD,R --format=%t"
+    req += " --jobs=" + ",".join(map(str, job_ids))
+    logging.debug(req)
+    response = call_program(req)
+    if response.returncode != 0:
+        # squeue rejects the query once it does not know any of the jobs
+        logging.debug(f"squeue failed: {response.stderr.strip()}")
+        return 0 if job_finished(job_ids) else None
+    return len(response.stdout.split())
+
+
+def monitor_progress(
+    total_tasks: int,
+    job_ids: list[int],
+    benchmarks: Benchmarks,
+    pair_ids: Sequence[int],
+    records: RecordsReader,
+):
+    """
+    Shows the progress of the array jobs until they are finished, and collects
+    the results of the finished jobs in the meantime. The tasks are followed
+    by listing their records and done files. Slurm is only asked about the
+    jobs if nothing changed for a while, e.g. because the tasks are pending
+    or were killed, and less often the longer this lasts. Monitoring ends once
+    all results have been collected or all tasks are finished, and returns
+    whether all results have been collected.
+    """
     p1 = tqdm(
         total=total_tasks,
         position=0,
@@ -227,98 +603,222 @@ def monitor_progress(total_tasks: int, job_id: int):
         dynamic_ncols=True,
     )
     p3 = tqdm(
-        total=10 * update_period_s,
+        total=len(pair_ids),
         position=2,
-        desc="   Next update",
+        desc="    Benchmarks",
         ncols=100,
         dynamic_ncols=True,
     )
-    current_finished = 0
-    current_started = 0
-    with p1 as pbar_started, p2 as pbar_finished, p3 as pbar_countdown:
-        while current_finished < total_tasks:
-            # give the server some rest before the next request
-            for _ in range(10 * update_period_s):
-                pbar_countdown.update(1)
-                time.sleep(0.1)
-
-            logging.debug("\n\n\nquerying slurm about running/pending tasks")
-            # check queue for running and pending tasks belonging to the jobs
-            req = "squeue --noheader --array --states=PD,R"
-            req += " --format=%t"
-            req += " --jobs=" + str(job_id)
-            logging.debug(req)
-            response = call_program(req)  # TODO: what if it does not work?
-            # count running and pending tasks
-            pending = response.stdout.count("PD")
-            running = response.stdout.count("R")
-            logging.debug("pending: " + str(pending))
-            logging.debug("running: " + str(running))
-            new_started = total_tasks - pending
-            new_finished = total_tasks - pending - running
-            pbar_started.update(new_started - current_started)
-            pbar_finished.update(new_finished - current_finished)
-            current_started = new_started
-            current_finished = new_finished
-
-            # if all tasks are finished (despite different counts), exit loop
-            if job_finished(job_id):
-                logging.debug("array job finished according to sacct")
-                pbar_started.update(total_tasks - current_started)
-                pbar_finished.update(total_tasks - current_finished)
-                break
-
-            # reset "spinner"
-            pbar_countdown.update(-10 * update_period_s)
-
-
-def cancel_job(job_id: int):
-    call_program("scancel " + str(job_id))
+    tools = ToolProgress(benchmarks, pair_ids, position=3)
+
+    def collected(pair_id: int, result: Result):
+        tools.update(benchmarks.tool_ids[pair_id], result)
+        pbar_pairs.update(1)
+
+    remaining = len(pair_ids)
+    state = (0, 0)
+    last_change = time.monotonic()
+    backoff = QUERY_BACKOFF_S
+    with p1 as pbar_started, p2 as pbar_finished, p3 as pbar_pairs:
+        try:
+            while True:
+                time.sleep(COLLECT_PERIOD_S)
+                new_results = records.collect(False, True, collected)
+                remaining -= new_results
+                tools.refresh()
+                started, finished = records.task_counts(job_ids)
+                pbar_started.update(started - pbar_started.n)
+                pbar_finished.update(finished - pbar_finished.n)
+                if remaining <= 0:
+                    logging.debug("all results of the array jobs collected")
+                    pbar_started.update(total_tasks - pbar_started.n)
+                    pbar_finished.update(total_tasks - pbar_finished.n)
+                    break
+                if finished >= total_tasks:
+                    logging.debug("all array tasks finished")
+                    break
+
+                now = time.monotonic()
+                if new_results > 0 or (started, finished) != state:
+                    state = (started, finished)
+                    last_change = now
+                    backoff = QUERY_BACKOFF_S
+                    continue
+                if now - last_change < backoff:
+                    continue
+                # tasks which were killed or never started leave no done file
+                active = query_active_tasks(job_ids)
+                logging.debug(f"pending or running tasks: {active}")
+                if active == 0:
+                    logging.debug("array jobs finished according to slurm")
+                    break
+                last_change = now
+                backoff = min(2 * backoff, QUERY_BACKOFF_MAX_S)
+        finally:
+            tools.close()
+    return remaining <= 0
+
+
+def queue_exhausted(queue_filename: str, slices: int) -> bool:
+    """Returns whether all slices of the work queue have been claimed."""
+    with open(queue_filename, "rb") as f:
+        return COUNTER.unpack(f.read(COUNTER.size))[0] >= slices
+
+
+def cancel_jobs(job_ids: list[int]):
+    call_program("scancel " + " ".join(map(str, job_ids)))
+
+
+def plan_job(
+    benchmarks: Benchmarks, pair_ids: Sequence[int], array_size: int
+) -> tuple[list[Sequence[int]], int, float | None]:
+    """
+    Returns the slices of the pairs, the number of array tasks to run them
+    and the time limit of the tasks, if it is estimated from the history.
+    """
+    # each task runs at least as many jobs as it runs concurrently
+    cpus = options.args().slurm_cpus_per_task
+    if options.args().slurm_slice_size is None:
+        # a single array job, whose size determines the size of the slices
+        tasks = min(math.ceil(len(pair_ids) / cpus), array_size)
+    else:
+        slice_size = max(options.args().slurm_slice_size, cpus)
+        tasks = math.ceil(len(pair_ids) / slice_size)
+    time_limit = None
+    if options.args().history_files:
+        # balance the slices by the runtimes of previous runs
+        slices, time_limit = plan_slices(benchmarks, pair_ids, tasks, cpus)
+    else:
+        slices = split(pair_ids, math.ceil(len(pair_ids) / tasks))
+    if options.args().slurm_work_queue:
+        # the tasks claim small slices one after another in the scheduled
+        # order, the planned slices only serve to estimate the time
+        workers = tasks * cpus
+        slice_size = len(pair_ids) // (workers * QUEUE_SLICES_PER_WORKER)
+        slices = split(pair_ids, max(1, slice_size))
+    else:
+        tasks = len(slices)
+    return slices, tasks, time_limit
+
+
+def run_pairs(
+    benchmarks: Benchmarks,
+    pair_ids: Sequence[int],
+    collector: ResultCollector,
+    records: RecordsReader,
+    tier: int,
+    retry: int,
+):
+    """
+    Runs the pairs in one or more array jobs per resource class and collects
+    their results. The array jobs are monitored, cancelled and collected
+    together.
+    """
+    job_ids = []
+    queues = []
+    total_tasks = 0
+    try:
+        # each resource class is run by its own array jobs, which request the
+        # time and memory of its limits
+        classes = limits.resource_classes(benchmarks, pair_ids)
+        for resource_class, ((timeout, memout), class_ids) in enumerate(
+            classes.items()
+        ):
+            if len(classes) > 1:
+                logging.info(
+                    f"{len(class_ids)} benchmarks with timeout {timeout}s "
+                    + f"and memout {memout}K"
+                )
+            # the classes share the array size in proportion to their size
+            array_size = options.args().slurm_array_size * len(class_ids)
+            array_size = max(1, array_size // len(pair_ids))
+            with limits.applied(timeout, memout):
+                slices, tasks, time_limit = plan_job(benchmarks, class_ids, array_size)
+                queue_filename = run_job(
+                    benchmarks,
+                    slices,
+                    tasks,
+                    time_limit,
+                    tier,
+                    retry,
+                    resource_class,
+                    job_ids,
+                )
+            if queue_filename is not None:
+                queues.append((queue_filename, len(slices)))
+            total_tasks += tasks
+
+        # continuously check status and collect the finished results
+        collected = monitor_progress(
+            total_tasks, job_ids, benchmarks, pair_ids, records
+        )
+    except:
+        logging.error("some exception occurred, will cancel slurm jobs")
+        if len(job_ids) > 0:
+            cancel_jobs(job_ids)
+        raise
+
+    # the results which were written after the last check
+    records.collect(True, True)
+    if (
+        collected
+        and len(queues) > 0
+        and all(queue_exhausted(*queue) for queue in queues)
+    ):
+        # the tasks which are still pending would only find the queue empty
+        logging.info("work queue done, cancelling the remaining array tasks")
+        cancel_jobs(job_ids)
+        return
+    log_task_states(job_ids)
 
 
 def slurm(benchmarks: Benchmarks):
     tmp_dir = str(os.path.normpath(options.args().slurm_tmp_dir))
     Path(tmp_dir).mkdir(parents=True, exist_ok=True)
+    if options.args().slurm_cpus_per_task == 0:
+        raise BenchmaxException("--slurm.cpus-per-task must be at least 1")
+    if options.args().slurm_slice_size == 0:
+        raise BenchmaxException("--slurm.slice-size must be at least 1")
 
-    if not options.args().only_collect:
+    if not options.args().only_collect and not options.args().resume:
         logging.info(f"clear directory for temporary results ({tmp_dir})")
         for f in glob.glob(tmp_dir + "/*"):
             os.remove(f)
 
-        try:
-            # submit job
-            array_size = min(len(benchmarks), options.args().slurm_array_size)
-            slice_size = math.ceil(len(benchmarks) / array_size)
-            array_size = math.ceil(len(benchmarks) / slice_size)
-            job_id = run_job(benchmarks, array_size, slice_size)
-            logging.info(f"job {job_id} scheduled.")
-
-            # continuously check status
-            monitor_progress(array_size, job_id)
-        except:
-            logging.error("some exception occurred, will cancel slurm jobs")
-            cancel_job(job_id)
-            raise
-    else:
-        logging.info("only collecting results.")
-
-    # collect jobs
-    logging.info("collecting results")
-    out_files = glob.glob(tmp_dir + "/JOB.*.out")
-    for f in out_files:
-        if not os.path.exists(f.replace(".out", ".err")):
-            raise BenchmaxException(f"missing corresponding err file for {f}")
-
-    logging.info(f"collected {len(out_files)} out files")
-
-    results = Results()
-
-    for f in tqdm(out_files, desc="parsing results", ncols=100, dynamic_ncols=True):
-        parse_chunk(benchmarks, f, results)
+    with ResultCollector(benchmarks) as collector:
+        records = RecordsReader(benchmarks, tmp_dir, collector)
+        for tier in collector.tiers():
+            if options.args().only_collect or options.args().resume:
+                # the logs of the previous run may contain unjournaled results,
+                # which are kept until the run is finished
+                records.collect(True, False)
+            if options.args().only_collect:
+                continue
+
+            pair_ids = collector.pending()
+            if len(pair_ids) == 0:
+                logging.info("no benchmarks left to run.")
+                continue
+
+            retries = options.args().slurm_retries
+            for retry in range(retries + 1):
+                if retry > 0:
+                    logging.warning(
+                        f"submitting {len(pair_ids)} benchmarks without result "
+                        + f"again (retry {retry} of {retries})"
+                    )
+                run_pairs(benchmarks, pair_ids, collector, records, tier, retry)
+                # pairs of failed array tasks, or whose tool could not be started
+                pair_ids = collector.missing(pair_ids)
+                if len(pair_ids) == 0:
+                    break
+            else:
+                logging.warning(
+                    f"{len(pair_ids)} benchmarks without result after {retries} retries"
+                )
 
     # finalize
-    check_for_missing_results(benchmarks, results)
-    write_results(benchmarks, results)
+    collector.finish()
 
     if options.args().slurm_archive_logs is not None:
         dirname = options.args().slurm_tmp_dir
@@ -336,8 +836,9 @@ def slurm(benchmarks: Benchmarks):
 
     if not options.args().slurm_keep_logs:
         logging.info("deleting log files directory for temporary results")
-        for f in out_files:
-            if os.path.exists(f):
-                os.remove(f)
-            if os.path.exists(f.replace(".out", ".err")):
-                os.remove(f.replace(".out", ".err"))
+        for f in records.offsets:
+            base = f.rsplit(".", 1)[0]
+            for extension in ["jsonl", "done", "started", "tgz", "out", "err"]:
+                log = f"{base}.{extension}"
+                if os.path.exists(log):
+                    os.remove(log)
@@ -1,14 +1,49 @@
-from random import shuffle
+from array import array
+from typing import Iterable, Iterator, Sequence
 
 from .tools.Tool import Tool
 
 
 class Benchmarks:
-    def __init__(self, tools: list[Tool], files: list[str]):
+    """
+    The tool-file pairs of a run. Every file name is stored once; a pair is
+    stored as the indices of its tool and file in two compact arrays and
+    identified by its position in these arrays (the pair id).
+    The files are sorted, so that the pair ids are the same in every
+    invocation with the same tools and inputs, e.g. to collect the results
+    of an earlier invocation by their ids.
+    The order in which the pairs are run is a separate sequence of pair ids,
+    which is set by scheduling.schedule().
+    """
+
+    def __init__(self, tools: list[Tool], files: Iterable[str]):
         self.tools = tools
-        self.files = files
-        self.pairs = [(t, f) for t in tools for f in files if t.can_handle(f)]
-        shuffle(self.pairs)
+        self.files: list[str] = []
+        self.tool_ids = array("H")
+        self.file_ids = array("I")
+        for f in sorted(files):
+            file_id = len(self.files)
+            self.files.append(f)
+            for tool_id, t in enumerate(tools):
+                if t.can_handle(f):
+                    self.tool_ids.append(tool_id)
+                    self.file_ids.append(file_id)
+        self.order: Sequence[int] = range(len(self))
 
     def __len__(self):
-        return len(self.pairs)
+        return len(self.tool_ids)
+
+    def pair(self, pair_id: int) -> tuple[Tool, str]:
+        return self.tools[self.tool_ids[pair_id]], self.files[self.file_ids[pair_id]]
+
+    def file(self, pair_id: int) -> str:
+        return self.files[self.file_ids[pair_id]]
+
+    def pairs(self) -> Iterator[tuple[Tool, str]]:
+        """Iterates over all pairs in the order of their ids."""
+        for tool_id, file_id in zip(self.tool_ids, self.file_ids):
+            yield self.tools[tool_id], self.files[file_id]
+
+    def scheduled(self) -> Iterator[int]:
+        """Iterates over the pair ids in the order in which they are run."""
+        return iter(self.order)
@@ -1,9 +1,10 @@
-import glob
 import logging
 import os.path
 
 from . import options
 from .benchmarks import Benchmarks
+from .inputs import collect_files
+from .scheduling import schedule
 from .backends.local import local
 from .backends.slurm import slurm
 from .BenchmaxException import BenchmaxException
@@ -45,41 +46,19 @@ def benchmax_main():
     if options.args().common_tool_prefix != "":
         options.args().common_tool_prefix += "/"
 
-    # gather input files
+    # gather input files and create benchmarking pairs
     logging.info("collecting input files")
-    files = []
-    if not (options.args().input_directories is None):
-        files += sum(
-            [
-                [
-                    f
-                    for f in glob.glob(os.path.normpath(dir) + "/**", recursive=True)
-                    if os.path.isfile(f)
-                ]
-                for dir in options.args().input_directories
-            ],
-            [],
-        )
-    if not (options.args().file_lists is None):
-        for l in options.args().file_lists:
-            with open(l, "r") as list:
-                fs = list.read().splitlines()
-            for f in fs:
-                if not os.path.isfile(f):
-                    logging.warning(f"Can't find given input file {f}. Skip.")
-                else:
-                    files.append(f)
-    if len(files) == 0:
+    benchmarks = Benchmarks(tools, collect_files(tools))
+    if len(benchmarks.files) == 0:
         raise BenchmaxException("No input files found!")
-    logging.info(f"number of collected input files: {len(files)}")
+    logging.info(f"number of collected input files: {len(benchmarks.files)}")
 
-    options.args().common_file_prefix = os.path.commonpath(files) + "/"
+    options.args().common_file_prefix = os.path.commonpath(benchmarks.files) + "/"
 
-    # create benchmarking pairs
-    benchmarks = Benchmarks(tools, files)
     if len(benchmarks) == 0:
         raise BenchmaxException("no valid input found for the given tools!")
     logging.debug(f"number of tool-input pairings: {len(benchmarks)}")
+    schedule(benchmarks)
 
     match options.args().backend:
         case "local":
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from queue import SimpleQueue
+from typing import Iterator
+
+from . import options
+from .manifest import DirectoryManifest, ListManifest, save_manifests
+from .tools.Tool import Tool
+
+# directory scans mostly wait for the (possibly remote) file system
+WALK_THREADS = 16
+
+
+def accepted_extensions(tools: list[Tool]) -> tuple[str, ...] | None:
+    """Returns the extensions accepted by any tool, or None if some tool accepts all."""
+    extensions = set()
+    for t in tools:
+        if t.extensions is None:
+            return None
+        extensions.update(t.extensions)
+    return tuple(extensions)
+
+
+def accepted(name: str, extensions: tuple[str, ...] | None) -> bool:
+    return extensions is None or name.endswith(extensions)
+
+
+def scan_directory(
+    directory: str, extensions: tuple[str, ...] | None
+) -> tuple[list[str], list[str]]:
+    files = []
+    subdirectories = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # like glob, ignore hidden files and directories
+                if entry.name.startswith("."):
+                    continue
+                # the file type is known from the directory entry, only
+                # symbolic links need an additional stat
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif accepted(entry.name, extensions) and entry.is_file():
+                    files.append(entry.path)
+    except OSError as e:
+        logging.warning(f"Can't read directory {directory}: {e}")
+    return files, subdirectories
+
+
+def walk_directories(
+    directories: list[str], extensions: tuple[str, ...] | None
+) -> Iterator[str]:
+    """
+    Yields all files with one of the given extensions in the directories and
+    their subdirectories, as soon as they are found. The directories are
+    scanned concurrently. With manifests, only the directories which changed
+    since the last run are scanned.
+    """
+    # finished scans are passed through a queue, waiting for any of the
+    # pending futures would take time linear in their number
+    finished = SimpleQueue()
+    with ThreadPoolExecutor(WALK_THREADS) as pool:
+
+        def submit(scan, directory: str):
+            future = pool.submit(scan, directory, extensions)
+            future.add_done_callback(lambda f: finished.put((scan, f)))
+
+        roots = []
+        for d in map(os.path.normpath, directories):
+            if options.args().manifest_dir is None:
+                roots.append((scan_directory, d))
+                continue
+            manifest = DirectoryManifest(options.args().manifest_dir, d)
+            yield from manifest.unchanged_files(pool, extensions)
+            roots += [(manifest.scan, s) for s in manifest.stale]
+        for scan, d in roots:
+            submit(scan, d)
+        pending = len(roots)
+        while pending > 0:
+            scan, future = finished.get()
+            pending -= 1
+            files, subdirectories = future.result()
+            for d in subdirectories:
+                submit(scan, d)
+            pending += len(subdirectories)
+            yield from files
+
+
+def read_file_lists(
+    file_lists: list[str], extensions: tuple[str, ...] | None
+) -> Iterator[str]:
+    for l in file_lists:
+        if options.args().manifest_dir is not None:
+            yield from ListManifest(options.args().manifest_dir, l).list_files(
+                extensions
+            )
+            continue
+        with open(l, "r") as list:
+            fs = list.read().splitlines()
+        for f in fs:
+            if not accepted(f, extensions):
+                continue
+            if not os.path.isfile(f):
+                logging.warning(f"Can't find given input file {f}. Skip.")
+            else:
+                yield f
+
+
+def collect_files(tools: list[Tool]) -> Iterator[str]:
+    """Yields the input files given by the options which any of the tools accepts."""
+    extensions = accepted_extensions(tools)
+    if extensions is not None:
+        logging.debug(f"only considering files with extensions {extensions}")
+    if options.args().input_directories is not None:
+        yield from walk_directories(options.args().input_directories, extensions)
+    if options.args().file_lists is not None:
+        yield from read_file_lists(options.args().file_lists, extensions)
+    save_manifests()
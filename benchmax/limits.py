@@ -0,0 +1,120 @@
+import argparse
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+import fnmatch
+import re
+from typing import Iterable, Iterator
+
+from . import options
+from .benchmarks import Benchmarks
+from .tools.Tool import Tool
+
+
+@dataclass
+class LimitRule:
+    """
+    Limits for the pairs whose tool and file match the given patterns, which
+    replace the global timeout and/or memout. A missing pattern matches all.
+    """
+
+    tool: re.Pattern | None
+    family: re.Pattern | None
+    timeout: int | None
+    memout: int | None
+
+    def matches(self, tool: Tool, file: str) -> bool:
+        if self.tool is not None:
+            name = tool.binary.removeprefix(options.args().common_tool_prefix)
+            if self.tool.fullmatch(name) is None:
+                return False
+        if self.family is not None:
+            name = file.removeprefix(options.args().common_file_prefix)
+            if self.family.fullmatch(name) is None:
+                return False
+        return True
+
+
+def parse_limit_rule(rule_str: str) -> LimitRule:
+    """
+    Parses a rule like "tool=*cdd,family=QF_NRA/kissing/*,timeout=10m,memout=1G".
+    The tool pattern is matched against the binary and the family pattern
+    against the file, both without their common prefix.
+    """
+    parts = {}
+    for part in rule_str.split(","):
+        key, sep, value = part.partition("=")
+        if sep == "" or key not in ["tool", "family", "timeout", "memout"]:
+            raise argparse.ArgumentTypeError(f"invalid limit rule part: {part}")
+        parts[key] = value
+    if "timeout" not in parts and "memout" not in parts:
+        raise argparse.ArgumentTypeError("limit rule without timeout or memout")
+
+    def pattern(key: str) -> re.Pattern | None:
+        if key not in parts:
+            return None
+        return re.compile(fnmatch.translate(parts[key]))
+
+    return LimitRule(
+        pattern("tool"),
+        pattern("family"),
+        options.parse_timeout(parts["timeout"]) if "timeout" in parts else None,
+        options.parse_memout(parts["memout"]) if "memout" in parts else None,
+    )
+
+
+def rules() -> list[LimitRule]:
+    return options.args().limit_rules or []
+
+
+def timeout_rule(tool: Tool, file: str) -> int | None:
+    """Returns the timeout of the last matching rule, if any."""
+    timeout = None
+    for rule in rules():
+        if rule.timeout is not None and rule.matches(tool, file):
+            timeout = rule.timeout
+    return timeout
+
+
+def pair_limits(tool: Tool, file: str) -> tuple[int, int]:
+    """
+    Returns the timeout and memout of the pair: those of the last matching
+    rule which sets them, or the global ones of the current timeout tier.
+    """
+    timeout = options.args().timeout
+    memout = options.args().memout
+    for rule in rules():
+        if rule.matches(tool, file):
+            timeout = rule.timeout if rule.timeout is not None else timeout
+            memout = rule.memout if rule.memout is not None else memout
+    return timeout, memout
+
+
+def resource_classes(
+    benchmarks: Benchmarks, pair_ids: Iterable[int]
+) -> dict[tuple[int, int], array]:
+    """
+    Groups the pairs by their timeout and memout, keeping their order within
+    each group. Without rules, all pairs are in the same group.
+    """
+    if len(rules()) == 0:
+        return {(options.args().timeout, options.args().memout): array("I", pair_ids)}
+    classes: dict[tuple[int, int], array] = {}
+    for i in pair_ids:
+        limits = pair_limits(*benchmarks.pair(i))
+        classes.setdefault(limits, array("I")).append(i)
+    return classes
+
+
+@contextmanager
+def applied(timeout: int, memout: int) -> Iterator[None]:
+    """
+    Sets the timeout and memout of a resource class as the global limits,
+    which are read by the backends, the tools and the runner context.
+    """
+    previous = options.args().timeout, options.args().memout
+    options.args().timeout, options.args().memout = timeout, memout
+    try:
+        yield
+    finally:
+        options.args().timeout, options.args().memout = previous
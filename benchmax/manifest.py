@@ -0,0 +1,375 @@
+from concurrent.futures import Executor
+import hashlib
+import json
+import logging
+import os
+from stat import S_ISREG
+import threading
+import time
+from typing import Iterator
+
+MANIFEST_VERSION = 1
+
+# directories modified this shortly before they were read may change again
+# within the resolution of their modification time, so they are read again
+RACY_NANOSECONDS = 2_000_000_000
+
+# number of batches in which the recorded directories are stat'ed
+STAT_CHUNKS = 64
+
+__MANIFESTS: list["Manifest"] = []
+
+
+def register(manifest: "Manifest"):
+    __MANIFESTS.append(manifest)
+
+
+def file_digest(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_json(filename: str) -> dict:
+    try:
+        with open(filename, "r") as f:
+            data = json.load(f)
+        if data.get("version") == MANIFEST_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def store_json(filename: str, data: dict):
+    # write to a temporary file first, an interrupted write keeps the old manifest
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp, filename)
+
+
+class Manifest:
+    """
+    On-disk record of the files of an input root, i.e. a directory or a file
+    list, with the size, modification time and (once it has been computed)
+    the content hash of each file.
+    The manifest consists of an index with the names of the files, which is
+    all that is needed to collect them, and the details of the files as
+    {directory: {name: [size, mtime_ns, digest]}}, which are only loaded
+    when something changed or a hash is requested.
+    """
+
+    kind = None
+
+    def __init__(self, directory: str, root: str):
+        self.root = root
+        path = os.path.abspath(root)
+        key = hashlib.sha256(path.encode()).hexdigest()[:16]
+        name = f"{directory}/{os.path.basename(path) or 'root'}-{key}"
+        self.index_file = name + ".json"
+        self.details_file = name + ".files.json"
+        os.makedirs(directory, exist_ok=True)
+        self.previous = load_json(self.index_file)
+        if self.previous.get("kind") != self.kind:
+            self.previous = {}
+        self.index_changed = False
+        self.details: dict[str, dict[str, list]] | None = None
+        self.details_changed = False
+        # the directories of the root which were read or found unchanged
+        self.directories: dict = {}
+        self.lock = threading.Lock()
+        self.started = time.time_ns()
+        register(self)
+
+    def racy(self, stat: os.stat_result) -> bool:
+        return stat.st_mtime_ns >= self.started - RACY_NANOSECONDS
+
+    def file_details(self) -> dict[str, dict[str, list]]:
+        with self.lock:
+            if self.details is None:
+                self.details = load_json(self.details_file).get("directories", {})
+            return self.details
+
+    def directory_key(self, directory: str) -> str | None:
+        return directory
+
+    def current_directories(self) -> dict:
+        return self.directories
+
+    def index(self) -> dict:
+        return {"version": MANIFEST_VERSION, "kind": self.kind}
+
+    def save(self):
+        if self.index_changed:
+            store_json(self.index_file, self.index())
+            self.index_changed = False
+        if self.details_changed:
+            # drop the directories which are not part of the root anymore
+            current = self.current_directories()
+            details = {k: v for k, v in self.details.items() if k in current}
+            store_json(
+                self.details_file,
+                {"version": MANIFEST_VERSION, "directories": details},
+            )
+            self.details_changed = False
+
+    def digest(self, filename: str) -> str | None:
+        """
+        Returns the content hash of the file if it belongs to this manifest.
+        Recorded hashes are only used if size and modification time of the
+        file are unchanged, otherwise the hash is computed and recorded.
+        """
+        directory, name = os.path.split(filename)
+        key = self.directory_key(directory)
+        if key is None or key not in self.current_directories():
+            return None
+        entry = self.file_details().get(key, {}).get(name, None)
+        if entry is None:
+            return None
+        stat = os.stat(filename)
+        if entry[:2] != [stat.st_size, stat.st_mtime_ns] or entry[2] is None:
+            entry[:] = [stat.st_size, stat.st_mtime_ns, file_digest(filename)]
+            self.details_changed = True
+        return entry[2]
+
+
+class DirectoryManifest(Manifest):
+    """
+    Manifest of a directory tree. A directory whose modification time is
+    unchanged is not read again, as adding, removing or renaming one of its
+    entries updates its modification time. Hence, only the directories
+    themselves have to be stat'ed to detect changes.
+    The index stores [mtime_ns, subdirectories, files] for each directory,
+    where the names are joined by "/" as this is much faster to load.
+    """
+
+    kind = "directory"
+
+    def __init__(self, directory: str, root: str):
+        super().__init__(directory, root)
+        self.prefix = root if root.endswith("/") else root + "/"
+        self.previous = self.previous.get("directories", {})
+        self.directories: dict[str, list] = {}
+
+    def path(self, key: str) -> str:
+        return self.root if key == "." else os.path.join(self.root, key)
+
+    def join(
+        self, key: str, names: str, extensions: tuple[str, ...] | None
+    ) -> list[str]:
+        """Returns the paths of the "/"-separated names in the given directory."""
+        if names == "":
+            return []
+        path = self.path(key)
+        # plain concatenation is much faster than os.path.join
+        prefix = path if path.endswith("/") else path + "/"
+        return [
+            prefix + n
+            for n in names.split("/")
+            if extensions is None or n.endswith(extensions)
+        ]
+
+    def directory_key(self, directory: str) -> str | None:
+        if directory == self.root:
+            return "."
+        if directory.startswith(self.prefix):
+            return directory[len(self.prefix) :]
+        return None
+
+    def index(self) -> dict:
+        index = super().index()
+        index["directories"] = self.directories
+        return index
+
+    def read_directory(self, directory: str, key: str) -> list:
+        previous_files = self.file_details().get(key, {})
+        subdirectories = []
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # like glob, ignore hidden files and directories
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    entry_details = [stat.st_size, stat.st_mtime_ns, None]
+                    known = previous_files.get(entry.name, None)
+                    if known is not None and known[:2] == entry_details[:2]:
+                        entry_details[2] = known[2]
+                    files[entry.name] = entry_details
+        self.details[key] = files
+        self.details_changed = True
+        return [None, "/".join(subdirectories), "/".join(files)]
+
+    def scan(
+        self, directory: str, extensions: tuple[str, ...] | None
+    ) -> tuple[list[str], list[str]]:
+        """Same as inputs.scan_directory(), but served from the manifest if possible."""
+        key = self.directory_key(directory)
+        try:
+            stat = os.stat(directory)
+            record = self.previous.get(key, None)
+            if record is None or record[0] != stat.st_mtime_ns:
+                record = self.read_directory(directory, key)
+                # a racy directory is read again next time
+                if not self.racy(stat):
+                    record[0] = stat.st_mtime_ns
+                self.index_changed = True
+        except OSError as e:
+            logging.warning(f"Can't read directory {directory}: {e}")
+            return [], []
+        self.directories[key] = record
+        _, subdirectories, files = record
+        return (
+            self.join(key, files, extensions),
+            self.join(key, subdirectories, None),
+        )
+
+    def modification_times(self, keys: list[str]) -> list[int | None]:
+        mtimes = []
+        for key in keys:
+            try:
+                mtimes.append(os.stat(self.path(key)).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def unchanged_files(
+        self, pool: Executor, extensions: tuple[str, ...] | None
+    ) -> Iterator[str]:
+        """
+        Yields the files of all recorded directories which did not change and
+        are still reachable from the root. The directories which have to be
+        scanned again are left in self.stale.
+        """
+        # all recorded directories are known in advance and stat'ed at once
+        keys = list(self.previous)
+        chunks = [keys[i::STAT_CHUNKS] for i in range(STAT_CHUNKS)]
+        mtimes = {}
+        for chunk, times in zip(chunks, pool.map(self.modification_times, chunks)):
+            mtimes.update(zip(chunk, times))
+        self.stale = []
+        keys = ["."]
+        while len(keys) > 0:
+            key = keys.pop()
+            record = self.previous.get(key, None)
+            if record is None or record[0] is None or mtimes[key] != record[0]:
+                self.stale.append(self.path(key))
+                continue
+            self.directories[key] = record
+            yield from self.join(key, record[2], extensions)
+            if record[1] != "":
+                keys += [
+                    s if key == "." else f"{key}/{s}" for s in record[1].split("/")
+                ]
+
+    def save(self):
+        # directories which were removed since the last run are dropped
+        if len(self.directories) != len(self.previous):
+            self.index_changed = True
+        super().save()
+
+
+class ListManifest(Manifest):
+    """
+    Manifest of a file list. The list is only read again if it changed, or if
+    one of the directories containing the listed files changed. For a listed
+    file which does not exist, the nearest existing directory above it is
+    recorded, so the file is found once it (or its directory) is created.
+    """
+
+    kind = "list"
+
+    def __init__(self, directory: str, root: str):
+        super().__init__(directory, root)
+        self.source = None
+        self.files: list[str] = []
+        self.directories: dict[str, int | None] = {}
+
+    def index(self) -> dict:
+        index = super().index()
+        index["source"] = self.source
+        index["files"] = "\n".join(self.files)
+        index["directories"] = self.directories
+        return index
+
+    def unchanged(self) -> bool:
+        if self.previous.get("source", None) != self.source:
+            return False
+        for directory, mtime in self.previous["directories"].items():
+            try:
+                if os.stat(directory or ".").st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def record_directory(self, directory: str):
+        while directory not in self.directories:
+            try:
+                dir_stat = os.stat(directory or ".")
+            except OSError:
+                parent = os.path.dirname(directory)
+                if parent == directory:
+                    return
+                directory = parent
+                continue
+            # a racy directory invalidates the manifest next time
+            mtime = None if self.racy(dir_stat) else dir_stat.st_mtime_ns
+            self.directories[directory] = mtime
+
+    def read_list(self):
+        details = self.file_details()
+        with open(self.root, "r") as list:
+            fs = list.read().splitlines()
+        for f in fs:
+            try:
+                stat = os.stat(f)
+            except OSError:
+                stat = None
+            directory, name = os.path.split(f)
+            self.record_directory(directory)
+            if stat is None or not S_ISREG(stat.st_mode):
+                logging.warning(f"Can't find given input file {f}. Skip.")
+                continue
+            entry_details = [stat.st_size, stat.st_mtime_ns, None]
+            known = details.get(directory, {}).get(name, None)
+            if known is not None and known[:2] == entry_details[:2]:
+                entry_details[2] = known[2]
+            details.setdefault(directory, {})[name] = entry_details
+            self.files.append(f)
+        self.index_changed = True
+        self.details_changed = True
+
+    def list_files(self, extensions: tuple[str, ...] | None) -> list[str]:
+        stat = os.stat(self.root)
+        self.source = [stat.st_size, stat.st_mtime_ns, os.getcwd()]
+        if self.unchanged():
+            # an empty list is stored as an empty string
+            self.files = [f for f in self.previous["files"].split("\n") if f]
+            self.directories = self.previous["directories"]
+        else:
+            self.read_list()
+        return [f for f in self.files if extensions is None or f.endswith(extensions)]
+
+
+def digest(filename: str) -> str:
+    """Returns the content hash of the file, taken from a manifest if possible."""
+    for m in __MANIFESTS:
+        d = m.digest(filename)
+        if d is not None:
+            return d
+    return file_digest(filename)
+
+
+def save_manifests():
+    for m in __MANIFESTS:
+        try:
+            m.save()
+        except OSError as e:
+            logging.warning(f"Can't write manifest {m.index_file}: {e}")
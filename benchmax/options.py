@@ -5,6 +5,7 @@ import re
 import sys
 
 from .backends.backends import add_backend_options
+from . import limits
 from .tools.tools import add_tool_options
 
 
@@ -21,6 +22,13 @@ def parse_timeout(time_str: str) -> int:
     return int(dt.timedelta(**time_params).total_seconds())
 
 
+def parse_timeout_tiers(time_str: str) -> list[int]:
+    tiers = [parse_timeout(t) for t in time_str.split(",")]
+    if any(a >= b for a, b in zip(tiers, tiers[1:])):
+        raise argparse.ArgumentTypeError("timeout tiers must be increasing")
+    return tiers
+
+
 def parse_memout(mem_str: str) -> int:
     regex = re.compile(r"([0-9]+)([KMG])i?")
     parts = regex.fullmatch(mem_str)
@@ -96,6 +104,45 @@ def parse_options(cmdlineoptions=None):
         action="store_true",
         dest="split_output",
     )
+    output_group.add_argument(
+        "--journal",
+        help="file to which each result is appended as soon as it is known "
+        + "(default: name of the output file with suffix .journal)",
+        metavar="FILE",
+        dest="journal_file",
+    )
+    output_group.add_argument(
+        "--resume",
+        help="continue an interrupted run: load the results from the journal "
+        + "and only run the remaining benchmarks",
+        action="store_true",
+    )
+    output_group.add_argument(
+        "--cache",
+        help="directory of a persistent result cache. Benchmarks whose tool "
+        + "binary, arguments, input file and limits are unchanged are not run again",
+        metavar="DIR",
+        dest="cache_dir",
+    )
+    output_group.add_argument(
+        "--cache.size",
+        help="maximum size of the result cache; unit must be one of "
+        + "K, Ki (Kiwibytes), M, Mi (Miwibytes), G, Gi (Giwibytes).",
+        metavar="<number><unit>",
+        dest="cache_size",
+        type=parse_memout,
+        default="1G",
+    )
+    output_group.add_argument(
+        "--output-limit",
+        help="amount of stdout and stderr of each tool run which is retained "
+        + "for parsing, half from the beginning and half from the end; unit "
+        + "must be one of K, Ki (Kiwibytes), M, Mi (Miwibytes), G, Gi (Giwibytes).",
+        metavar="<number><unit>",
+        dest="output_limit",
+        type=parse_memout,
+        default="4M",
+    )
     output_group.add_argument(
         "-s", "--statistics", help="collect statistics if possible", action="store_true"
     )
@@ -115,9 +162,12 @@ def parse_options(cmdlineoptions=None):
     benchmark_group.add_argument(
         "-T",
         "--timeout",
-        help="time limit per benchmark instance",
-        metavar="[<hours>h][<minutes>m][<seconds>s]",
-        type=parse_timeout,
+        help="time limit per benchmark instance. If a comma-separated list of "
+        + "increasing limits is given, all benchmarks are first run with the "
+        + "first limit and only timeouts are run again with the next limit",
+        metavar="[<hours>h][<minutes>m][<seconds>s][,...]",
+        dest="timeout_tiers",
+        type=parse_timeout_tiers,
         required=True,
     )
     benchmark_group.add_argument(
@@ -127,6 +177,39 @@ def parse_options(cmdlineoptions=None):
         type=positive_int,
         default=3,
     )
+    benchmark_group.add_argument(
+        "--limits",
+        help="timeout and/or memout for the benchmarks of some tools or "
+        + "instance families instead of -T/-M, given as comma-separated "
+        + "key=value pairs like tool=*cdd,family=QF_NRA/kissing/*,memout=1G. "
+        + "The tool and family patterns match the binary and the input file, "
+        + "the last matching rule takes precedence",
+        metavar="RULE",
+        dest="limit_rules",
+        type=limits.parse_limit_rule,
+        nargs="+",
+    )
+    benchmark_group.add_argument(
+        "--schedule",
+        help="order in which the benchmarks are run: random, or longest "
+        + "expected runtime first (based on the results given by --history)",
+        choices=["random", "longest-first"],
+        default="random",
+    )
+    benchmark_group.add_argument(
+        "--seed",
+        help="seed for the random order of the benchmarks (default: random, "
+        + "the used seed is logged)",
+        metavar="N",
+        type=int,
+    )
+    benchmark_group.add_argument(
+        "--history",
+        help="CSV or XML result file(s) of previous runs to estimate runtimes from",
+        metavar="FILE",
+        dest="history_files",
+        nargs="+",
+    )
     benchmark_group.add_argument(
         "-D",
         "--directory",
@@ -142,6 +225,14 @@ def parse_options(cmdlineoptions=None):
         dest="file_lists",
         nargs="+",
     )
+    benchmark_group.add_argument(
+        "--manifest",
+        help="directory for manifests of the input directories and file lists, "
+        + "which record the input files such that unchanged directories are "
+        + "not read again",
+        metavar="DIR",
+        dest="manifest_dir",
+    )
 
     add_backend_options(ap)
     add_tool_options(ap)
@@ -166,6 +257,9 @@ def parse_options(cmdlineoptions=None):
         if res.file_lists is None or len(res.file_lists) == 0:
             raise argparse.ArgumentError("No valid inputs given!")
 
+    # the final tier is the effective timeout, the backends iterate the tiers
+    res.timeout = res.timeout_tiers[-1]
+
     res.start_time = int(dt.datetime.now().timestamp())
 
     return res
@@ -179,3 +273,9 @@ def args(cmdlineoptions=None):
     if __PARSED_ARGS is None:
         __PARSED_ARGS = parse_options()
     return __PARSED_ARGS
+
+
+def set_args(parsed_args):
+    """Sets the options in processes which do not parse the command line."""
+    global __PARSED_ARGS
+    __PARSED_ARGS = parsed_args
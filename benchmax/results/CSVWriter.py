@@ -9,6 +9,15 @@ from ..results.Results import Results
 from ..tools.Tool import Tool
 from .. import options
 
+BASIC_COLUMNS = [
+    "runtime",
+    "peak_memory_kbytes",
+    "answer",
+    "exitcode",
+    "user_time",
+    "system_time",
+]
+
 
 def write_results_csv(
     benchmarks: Benchmarks,
@@ -22,7 +31,7 @@ def write_results_csv(
     # header: solvers and stats in two rows
     columns_dict = {t: set() for t in tools}
 
-    for t, f in benchmarks.pairs:
+    for t, f in benchmarks.pairs():
         if t in tools:
             r = results.get(t, f)
             if r is None:
@@ -34,9 +43,9 @@ def write_results_csv(
     second_row = [""]
     for t in columns_dict:
         first_row += [t.binary.removeprefix(options.args().common_tool_prefix)] * (
-            4 + len(columns_dict[t])
+            len(BASIC_COLUMNS) + len(columns_dict[t])
         )
-        second_row += ["runtime", "peak_memory_kbytes", "answer", "exitcode"]
+        second_row += BASIC_COLUMNS
         second_row += list(columns_dict[t])
 
     # write the actual results
@@ -50,13 +59,15 @@ def write_results_csv(
             for t in columns_dict:
                 result = results.get(t, f)
                 if result is None:
-                    row += [None] * (4 + len(columns_dict[t]))
+                    row += [None] * (len(BASIC_COLUMNS) + len(columns_dict[t]))
                 else:
                     row += [
                         int(result.runtime / timedelta(milliseconds=1)),
                         int(result.peak_memory_kbytes),
                         str(result.answer),
                         int(result.exit_code),
+                        int(result.user_time / timedelta(milliseconds=1)),
+                        int(result.system_time / timedelta(milliseconds=1)),
                     ] + [result.additional_info.get(s, None) for s in columns_dict[t]]
             writer.writerow(row)
 
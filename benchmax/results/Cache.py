@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+
+from .. import options
+from .. import limits
+from ..manifest import digest
+from ..results.Journal import result_from_dict, result_to_dict
+from ..results.Result import Result
+from ..tools.Tool import Tool
+
+
+class Cache:
+    """
+    Persistent, content-addressed store of results.
+    A result is identified by the contents of the tool binary and the input
+    file, the arguments of the tool and the limits. Each result is stored in
+    its own small JSON file, whose modification time marks its last use.
+    The total size of the entries is kept in a counter file, so the entries
+    only have to be listed when the size limit is exceeded.
+    """
+
+    def __init__(self, directory: str, max_size_kbytes: int):
+        self.directory = directory
+        self.max_size = max_size_kbytes * 1000
+        self.digests: dict[str, str] = {}
+        self.hits = 0
+        # bytes added to the cache by this run, not yet in the counter file
+        self.added = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def digest(self, filename: str) -> str:
+        d = self.digests.get(filename, None)
+        if d is None:
+            d = digest(filename)
+            self.digests[filename] = d
+        return d
+
+    def key(self, tool: Tool, file: str) -> str:
+        h = hashlib.sha256()
+        for part in [
+            type(tool).__name__,
+            self.digest(tool.binary),
+            tool.arguments,
+            self.digest(file),
+            *map(str, limits.pair_limits(tool, file)),
+            str(options.args().statistics),
+        ]:
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def path(self, key: str) -> str:
+        return f"{self.directory}/{key[:2]}/{key[2:]}.json"
+
+    def get(self, tool: Tool, file: str) -> Result | None:
+        path = self.path(self.key(tool, file))
+        try:
+            with open(path, "r") as f:
+                result = result_from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+        # mark the entry as recently used for the eviction
+        os.utime(path)
+        self.hits += 1
+        return result
+
+    def store(self, tool: Tool, file: str, result: Result):
+        path = self.path(self.key(tool, file))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, concurrent readers never see partial files
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(result_to_dict(result), f)
+        self.added += os.path.getsize(tmp)
+        try:
+            # an entry is replaced if it was not used, e.g. in a new timeout tier
+            self.added -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp, path)
+
+    def size_file(self) -> str:
+        return f"{self.directory}/size"
+
+    def read_size(self) -> int | None:
+        try:
+            with open(self.size_file(), "r") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write_size(self, size: int):
+        tmp = f"{self.size_file()}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(size))
+        os.replace(tmp, self.size_file())
+        self.added = 0
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the size limit is met.
+        The entries are only listed if the counted size exceeds the limit, or
+        if there is no counter yet.
+        """
+        size = self.read_size()
+        if size is not None and size + self.added <= self.max_size:
+            self.write_size(size + self.added)
+            return
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_size:
+            # the listing also corrects the counter, e.g. after entries were
+            # removed by hand
+            self.write_size(total)
+            return
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        self.write_size(total)
+        logging.info(f"evicted {removed} entries from the result cache")
@@ -0,0 +1,120 @@
+from datetime import timedelta
+import json
+import logging
+import os
+import time
+
+from ..benchmarks import Benchmarks
+from ..results.Result import Result
+from ..results.Results import Results
+from ..tools.Tool import Tool
+
+
+def tool_key(tool: Tool) -> tuple[str, str, str]:
+    return (tool.name, tool.binary, tool.arguments)
+
+
+def result_to_dict(result: Result) -> dict:
+    # stdout and stderr are not stored, the writers do not use them
+    return {
+        "exit_code": result.exit_code,
+        "runtime": result.runtime / timedelta(milliseconds=1),
+        "user_time": result.user_time / timedelta(milliseconds=1),
+        "system_time": result.system_time / timedelta(milliseconds=1),
+        "peak_memory_kbytes": result.peak_memory_kbytes,
+        "answer": result.answer,
+        "additional_info": result.additional_info,
+    }
+
+
+def result_from_dict(data: dict) -> Result:
+    return Result(
+        exit_code=data["exit_code"],
+        runtime=timedelta(milliseconds=data["runtime"]),
+        user_time=timedelta(milliseconds=data["user_time"]),
+        system_time=timedelta(milliseconds=data["system_time"]),
+        peak_memory_kbytes=data["peak_memory_kbytes"],
+        answer=data["answer"],
+        additional_info=data["additional_info"],
+    )
+
+
+class Journal:
+    """
+    Append-only JSONL file containing every result as soon as it is known,
+    so that an interrupted run can be resumed.
+    Each entry is handed to the OS immediately, which suffices if benchmax
+    crashes. To limit the overhead, the file is only synced to disk every
+    sync_interval seconds.
+    """
+
+    def __init__(self, filename: str, sync_interval: float = 5.0):
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.file = None
+        self.last_sync = time.monotonic()
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.filename)
+
+    def load(self, benchmarks: Benchmarks, results: Results) -> int:
+        """
+        Adds all journaled results for pairs of the given benchmarks to results.
+        Returns the number of loaded results.
+        """
+        tools = {tool_key(t): t for t in benchmarks.tools}
+        files = set(benchmarks.files)
+        count = 0
+        with open(self.filename, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be incomplete after a crash
+                    logging.warning(f"skipping corrupt entry in {self.filename}")
+                    continue
+                tool = tools.get(tuple(entry["tool"]), None)
+                if tool is None or entry["file"] not in files:
+                    continue
+                results.add_result(
+                    tool, entry["file"], result_from_dict(entry["result"])
+                )
+                count += 1
+        return count
+
+    def open(self, append: bool):
+        self.file = open(self.filename, "a" if append else "w")
+        self.last_sync = time.monotonic()
+
+    def append(self, tool: Tool, file: str, result: Result):
+        entry = {
+            "tool": tool_key(tool),
+            "file": file,
+            "result": result_to_dict(result),
+        }
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, exc_value, traceback):
+        self.close()
@@ -6,6 +6,8 @@ from datetime import timedelta
 class Result:
     exit_code: int = -1
     runtime: timedelta = field(default_factory=timedelta)
+    user_time: timedelta = field(default_factory=timedelta)
+    system_time: timedelta = field(default_factory=timedelta)
     peak_memory_kbytes: int = 0
     answer: str = "None"
     stdout: str = ""
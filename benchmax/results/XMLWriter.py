@@ -60,7 +60,10 @@ def sanitize_file(text: str) -> str:
 
 
 def write_run(parent: WriteXMLNode, tool: Tool, result: Result):
-    with parent.write_child("run", solver_id=sanitize_tool(tool.binary)) as run:
+    # the options tell several configurations of the same binary apart
+    with parent.write_child(
+        "run", solver_id=sanitize_tool(tool.binary), options=sanitize(tool.arguments)
+    ) as run:
         if len(result.additional_info) > 0:
             with run.write_child("statistics") as statistics:
                 for key, value in result.additional_info.items():
@@ -79,6 +82,18 @@ def write_run(parent: WriteXMLNode, tool: Tool, result: Result):
                 name="runtime",
                 type="milliseconds",
             )
+            resnode.write_leaf(
+                "result",
+                text=str(int(result.user_time / timedelta(milliseconds=1))),
+                name="user_time",
+                type="milliseconds",
+            )
+            resnode.write_leaf(
+                "result",
+                text=str(int(result.system_time / timedelta(milliseconds=1))),
+                name="system_time",
+                type="milliseconds",
+            )
             resnode.write_leaf(
                 "result",
                 text=str(result.peak_memory_kbytes),
@@ -0,0 +1,275 @@
+from array import array
+from collections import Counter
+import csv
+import heapq
+import logging
+import math
+import os.path
+import random
+from random import Random
+from statistics import NormalDist
+from typing import Iterator, Sequence
+import xml.etree.ElementTree as ET
+
+from . import options
+from .benchmarks import Benchmarks
+from .tools.Tool import Tool
+
+# quantile of the predicted duration of the slices which is requested from slurm
+TIME_QUANTILE = 0.99
+
+# relative deviation of runtimes which are known from a previous run
+RUNTIME_NOISE = 0.1
+
+# time for starting a slice, i.e. loading the environment and the runner
+SLICE_STARTUP_SECONDS = 60
+
+
+# a tool is identified by its binary without the common prefix and its
+# arguments, which are None if the result file does not record them
+ToolKey = tuple[str, str | None]
+
+
+def load_csv_history(filename: str, history: dict[tuple[ToolKey, str], float]):
+    with open(filename, "r", newline="") as f:
+        reader = csv.reader(f)
+        tools = next(reader)
+        columns = next(reader)
+        runtime_columns = [i for i, c in enumerate(columns) if c == "runtime"]
+        # the header only names the binaries, so several configurations of
+        # the same binary cannot be told apart
+        counts = Counter(tools[i] for i in runtime_columns)
+        ambiguous = [tool for tool, n in counts.items() if n > 1]
+        if len(ambiguous) > 0:
+            logging.warning(
+                f"{filename} contains several configurations of {ambiguous}, "
+                + "their runtimes are ignored"
+            )
+        runtime_columns = [i for i in runtime_columns if counts[tools[i]] == 1]
+        for row in reader:
+            for i in runtime_columns:
+                if i < len(row) and row[i] != "":
+                    history[((tools[i], None), row[0])] = int(row[i]) / 1000
+
+
+def load_xml_history(filename: str, history: dict[tuple[ToolKey, str], float]):
+    root = ET.parse(filename).getroot()
+    # older files record the options only in the list of solvers
+    solvers = Counter(s.get("solver_id") for s in root.findall("./solvers/solver"))
+    options_of = {
+        s.get("solver_id"): s.get("options") for s in root.findall("./solvers/solver")
+    }
+    ambiguous = set()
+    for file in root.findall("./benchmarks/file"):
+        for run in file.findall("./run"):
+            runtime = run.find("./results/result[@name='runtime']")
+            if runtime is None:
+                continue
+            solver_id = run.get("solver_id")
+            arguments = run.get("options")
+            if arguments is None:
+                if solvers[solver_id] > 1:
+                    ambiguous.add(solver_id)
+                    continue
+                arguments = options_of.get(solver_id, None)
+            key = ((solver_id, arguments), file.get("name"))
+            history[key] = int(runtime.text) / 1000
+    if len(ambiguous) > 0:
+        logging.warning(
+            f"{filename} contains several configurations of {sorted(ambiguous)}, "
+            + "their runtimes are ignored"
+        )
+
+
+def load_history(filenames: list[str]) -> dict[tuple[ToolKey, str], float]:
+    """
+    Loads the runtimes (in seconds) from previous CSV or XML result files,
+    indexed by the tool and file names as written in these files, i.e.
+    without the common prefixes. The tool is given by its binary and, if
+    recorded in the file, its arguments.
+    """
+    history = {}
+    for filename in filenames:
+        logging.info(f"loading runtimes from {filename}")
+        if filename.endswith(".xml"):
+            load_xml_history(filename, history)
+        else:
+            load_csv_history(filename, history)
+    return history
+
+
+def mean_and_deviation(runtimes: list[float]) -> tuple[float, float]:
+    # statistics.mean and pstdev compute exactly, which is much slower
+    mean = math.fsum(runtimes) / len(runtimes)
+    variance = math.fsum((r - mean) ** 2 for r in runtimes) / len(runtimes)
+    return mean, math.sqrt(variance)
+
+
+class RuntimeModel:
+    """
+    Predicts the runtime of tool-file pairs from previous results.
+    Results without the arguments of their tool (from CSV files) are used
+    for all configurations of its binary.
+    Pairs without previous result are estimated by the mean runtime of the
+    closest directory containing known results, preferably for the same tool.
+    Besides the expected runtime, the model gives its standard deviation: the
+    spread of the runtimes the estimate is based on, or a small fraction of
+    the runtime for pairs with a previous result.
+    """
+
+    def __init__(self, history: dict[tuple[ToolKey, str], float]):
+        self.limit = options.args().timeout + options.args().gracetime
+        self.exact: dict[tuple[ToolKey, str], float] = {}
+        self.any_tool: dict[str, list[float]] = {}
+        families: dict[tuple[ToolKey | None, str], list[float]] = {}
+        for (tool, file), runtime in history.items():
+            runtime = min(runtime, self.limit)
+            self.exact[(tool, file)] = runtime
+            self.any_tool.setdefault(file, []).append(runtime)
+            directory = os.path.dirname(file)
+            while True:
+                families.setdefault((tool, directory), []).append(runtime)
+                families.setdefault((None, directory), []).append(runtime)
+                if directory == "":
+                    break
+                directory = os.path.dirname(directory)
+        self.families = {k: mean_and_deviation(v) for k, v in families.items()}
+
+    def tool_keys(self, tool: Tool) -> list[ToolKey]:
+        # the exact configuration first, then the binary with any arguments
+        name = tool.binary.removeprefix(options.args().common_tool_prefix)
+        return [(name, tool.arguments), (name, None)]
+
+    def file_name(self, file: str) -> str:
+        return file.removeprefix(options.args().common_file_prefix)
+
+    def estimate(self, tool: Tool, file: str) -> float:
+        return self.distribution(tool, file)[0]
+
+    def distribution(self, tool: Tool, file: str) -> tuple[float, float]:
+        """Returns the expected runtime of the pair and its standard deviation."""
+        tool_keys = self.tool_keys(tool)
+        file_name = self.file_name(file)
+        for tool_key in tool_keys:
+            runtime = self.exact.get((tool_key, file_name), None)
+            if runtime is not None:
+                return runtime, RUNTIME_NOISE * runtime
+        if file_name in self.any_tool:
+            return mean_and_deviation(self.any_tool[file_name])
+        directory = os.path.dirname(file_name)
+        while True:
+            for tool_key in [*tool_keys, None]:
+                if (tool_key, directory) in self.families:
+                    return self.families[(tool_key, directory)]
+            if directory == "":
+                break
+            directory = os.path.dirname(directory)
+        # nothing known at all: assume the worst
+        return self.limit, 0.0
+
+
+def runtime_model() -> RuntimeModel:
+    return RuntimeModel(load_history(options.args().history_files or []))
+
+
+class Permutation:
+    """
+    Seeded pseudo-random permutation of range(n) which is computed on the fly
+    instead of being materialized, as i -> (a * i + b) mod n with a coprime to n.
+    The stride a is drawn from the middle of the range, so that consecutive
+    positions are spread over all pairs.
+    """
+
+    def __init__(self, n: int, seed: int):
+        self.n = n
+        rng = Random(seed)
+        self.a = 1
+        self.b = 0
+        if n > 2:
+            self.a = rng.randrange(n // 4, 3 * n // 4 + 1)
+            while math.gcd(self.a, n) != 1:
+                self.a += 1
+            self.b = rng.randrange(n)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i: int) -> int:
+        if not 0 <= i < self.n:
+            raise IndexError("permutation index out of range")
+        return (self.a * i + self.b) % self.n
+
+    def __iter__(self) -> Iterator[int]:
+        # adding a modulo n avoids a multiplication per element
+        value = self.b
+        for _ in range(self.n):
+            yield value
+            value += self.a
+            if value >= self.n:
+                value -= self.n
+
+
+def schedule(benchmarks: Benchmarks):
+    """Sets the order in which the pairs are run according to the scheduling policy."""
+    seed = options.args().seed
+    if seed is None:
+        seed = random.randrange(1 << 32)
+    logging.info(f"scheduling seed: {seed}")
+    order = Permutation(len(benchmarks), seed)
+    if options.args().schedule == "longest-first":
+        model = runtime_model()
+
+        def estimate(pair_id: int) -> float:
+            return model.estimate(*benchmarks.pair(pair_id))
+
+        # sort is stable, so pairs with equal estimates stay shuffled
+        order = array("I", sorted(order, key=estimate, reverse=True))
+    benchmarks.order = order
+
+
+def plan_slices(
+    benchmarks: Benchmarks, pair_ids: Sequence[int], n_slices: int, concurrency: int
+) -> tuple[list[array], float]:
+    """
+    Distributes the pairs to the given number of slices such that the expected
+    durations of the slices are balanced: the pairs are assigned in order of
+    decreasing expected runtime, each to the slice with the least expected
+    duration so far. Each slice runs its pairs in this order.
+    Returns the slices and the time in seconds to request for them, which is
+    a high quantile of the predicted duration of the longest slice plus a
+    safety margin for an unexpected timeout and the startup of the slice.
+    """
+    model = runtime_model()
+    means = array("d")
+    variances = array("d")
+    for i in pair_ids:
+        mean, deviation = model.distribution(*benchmarks.pair(i))
+        means.append(mean)
+        variances.append(deviation * deviation)
+    # sort is stable, so the scheduled order is kept for equal estimates
+    by_runtime = sorted(range(len(pair_ids)), key=means.__getitem__, reverse=True)
+
+    slices = [array("I") for _ in range(n_slices)]
+    slice_variances = [0.0] * n_slices
+    # the number of pairs breaks ties between slices, e.g. for runtimes of 0
+    heap = [(0.0, 0, s) for s in range(n_slices)]
+    for k in by_runtime:
+        duration, count, s = heap[0]
+        slices[s].append(pair_ids[k])
+        slice_variances[s] += variances[k]
+        heapq.heapreplace(heap, (duration + means[k], count + 1, s))
+
+    # the runtimes of the pairs are assumed to be independent, so the duration
+    # of a slice is approximately normally distributed
+    z = NormalDist().inv_cdf(TIME_QUANTILE)
+    expected = max(duration for duration, _, _ in heap) / concurrency
+    quantile = max(
+        (duration + z * math.sqrt(slice_variances[s])) / concurrency
+        for duration, _, s in heap
+    )
+    time_limit = quantile + model.limit + SLICE_STARTUP_SECONDS
+    logging.info(
+        f"planned {n_slices} slices with an expected duration of at most "
+        + f"{expected:.0f}s, requesting {time_limit:.0f}s"
+    )
+    return slices, time_limit
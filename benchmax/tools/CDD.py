@@ -5,12 +5,11 @@ from .Tool import Tool
 
 
 class CDD(Tool):
+    extensions = (".ine",)
+
     def __init__(self, command: str):
         super().__init__(command, "CDD")
 
-    def can_handle(self, file: str) -> bool:
-        return file.endswith(".ine")
-
     def parse_additional(self, result: Result):
         m = re.search(
             r"begin\s+(\d+)\s+[\s\S]*begin\s+(\d+)\s+[\s\S]*end", result.stdout
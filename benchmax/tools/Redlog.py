@@ -4,12 +4,11 @@ from .Tool import Tool
 
 
 class Redlog(Tool):
+    extensions = (".red",)
+
     def __init__(self, command: str):
         super().__init__(command, "Redlog")
 
-    def can_handle(self, file: str) -> bool:
-        return file.endswith(".red")
-
     def get_command_line(self, file: str) -> str:
         return (
             self.binary
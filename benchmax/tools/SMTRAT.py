@@ -44,6 +44,8 @@ def parse_stats(result: Result) -> bool:
 
 
 class SMTRAT(Tool):
+    extensions = (".smt2",)
+
     def __init__(self, command: str, name="SMTRAT"):
         super().__init__(command, name=name)
 
@@ -53,9 +55,6 @@ class SMTRAT(Tool):
             res += " --stats.print"
         return res + " " + file
 
-    def can_handle(self, file: str) -> bool:
-        return file.endswith(".smt2")
-
     def parse_additional(self, result: Result):
         match result.exit_code:
             case 2:
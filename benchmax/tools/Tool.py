@@ -1,7 +1,6 @@
 from dataclasses import dataclass
 import logging
 import os
-import re
 
 from ..results.Result import Result
 
@@ -12,6 +11,10 @@ class Tool:
     binary: str
     arguments: str
 
+    # file extensions of the inputs the tool can handle, None for all files.
+    # Used to skip other files while collecting the inputs.
+    extensions = None
+
     def __init__(self, command: str, name="Generic"):
         self.name = name
 
@@ -28,20 +31,11 @@ class Tool:
             self.arguments = ""
 
     def can_handle(self, file: str) -> bool:
-        return True
+        return self.extensions is None or file.endswith(self.extensions)
 
-    # Important: the file has to be the last argument in the command
-    # so that escaping regex in parse_command_line works
     def get_command_line(self, file: str) -> str:
         return self.binary + " " + self.arguments + " " + file
 
-    def parse_command_line(self, cmd: str) -> str | None:
-        pattern = re.compile(re.escape(self.get_command_line("")) + "(.+)")
-        m = pattern.match(cmd)
-        if m is None:
-            return None
-        return m.group(1)
-
     def parse_additional(self, result: Result):
         pass
 
@@ -31,6 +31,8 @@ def parse_stats(result: Result) -> bool:
     return True
 
 class Z3(Tool):
+    extensions = (".smt2",)
+
     def __init__(self, command: str):
         super().__init__(command, "Z3")
 
@@ -40,9 +42,6 @@ class Z3(Tool):
             res += " -st"
         return res  + " " + file
 
-    def can_handle(self, file: str) -> bool:
-        return file.endswith(".smt2")
-
     def parse_additional(self, result: Result):
         if "unsat" in result.stdout:
             result.answer = "unsat"
@@ -6,6 +6,8 @@ from .Tool import Tool
 
 
 class cvc5(Tool):
+    extensions = (".smt2",)
+
     def __init__(self, command: str):
         super().__init__(command, "Z3")
 
@@ -15,9 +17,6 @@ class cvc5(Tool):
             res += " --stats --stats-internal"
         return res  + " " + file
 
-    def can_handle(self, file: str) -> bool:
-        return file.endswith(".smt2")
-
     def parse_additional(self, result: Result):
         if "unsat" in result.stdout:
             result.answer = "unsat"